@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""!
+\brief Reachability on integer-indexed graphs
+
+\details
+    Forward and backward reachability on a graph whose vertices are numbered
+    from 0 to n-1. Vertices are marked in a byte array (one byte per vertex),
+    so membership tests and updates take a constant time. Used for trimming
+    automata. Provides also a decomposition to strongly connected components
+    (Tarjan's algorithm) and bandwidth-reducing orderings of vertices (BFS,
+    reverse Cuthill-McKee).
+
+\author Vojtěch Havlena
+
+\copyright
+    Copyright (C) 2020  Vojtech Havlena, <ihavlena@fit.vutbr.cz>\n
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.\n
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.\n
+    You should have received a copy of the GNU General Public License.
+    If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools
+
+from typing import Iterable, List, Tuple
+
+
+class Reachability:
+    """!
+    Forward and backward reachability on an integer-indexed graph
+    """
+
+    def __init__(self, num_vertices: int, edges: Iterable[Tuple[int, int]]):
+        """!
+        Constructor
+
+        @param num_vertices: Number of vertices (vertices are 0 to num_vertices-1)
+        @param edges: Edges (pairs source, destination)
+        """
+        self.num_vertices = num_vertices
+        self.succ: List[List[int]] = [[] for _ in range(num_vertices)]
+        self.pred: List[List[int]] = [[] for _ in range(num_vertices)]
+        for src, dest in edges:
+            self.succ[src].append(dest)
+            self.pred[dest].append(src)
+
+
+    @staticmethod
+    def _search(adjacency: List[List[int]], seeds: Iterable[int]) -> bytearray:
+        """!
+        Mark all vertices reachable from seeds.
+
+        @param adjacency: Adjacency lists
+        @param seeds: Seed vertices
+
+        @return Byte array (nonzero item -- the vertex is reachable)
+        """
+        visited = bytearray(len(adjacency))
+        stack = []
+        for v in seeds:
+            if not visited[v]:
+                visited[v] = 1
+                stack.append(v)
+        while stack:
+            head = stack.pop()
+            for v in adjacency[head]:
+                if not visited[v]:
+                    visited[v] = 1
+                    stack.append(v)
+        return visited
+
+
+    def forward(self, seeds: Iterable[int]) -> bytearray:
+        """!
+        Get vertices reachable from seeds.
+
+        @param seeds: Seed vertices
+
+        @return Byte array (nonzero item -- the vertex is reachable)
+        """
+        return Reachability._search(self.succ, seeds)
+
+
+    def backward(self, seeds: Iterable[int]) -> bytearray:
+        """!
+        Get vertices from which some of seeds is reachable.
+
+        @param seeds: Seed vertices
+
+        @return Byte array (nonzero item -- some seed is reachable from the vertex)
+        """
+        return Reachability._search(self.pred, seeds)
+
+
+    def useful(self, initials: Iterable[int], finals: Iterable[int]) -> bytearray:
+        """!
+        Get vertices that are reachable from initials and from which some of
+        finals is reachable.
+
+        @param initials: Initial vertices
+        @param finals: Final vertices
+
+        @return Byte array (nonzero item -- the vertex is useful)
+        """
+        fwd = int.from_bytes(self.forward(initials), "little")
+        bwd = int.from_bytes(self.backward(finals), "little")
+        return bytearray((fwd & bwd).to_bytes(self.num_vertices, "little"))
+
+
+    def breadth_first_order(self, seeds: Iterable[int]) -> List[int]:
+        """!
+        Get all vertices in the BFS order from seeds (vertices unreachable
+        from seeds follow in the BFS order from the least unvisited vertex).
+
+        @param seeds: Seed vertices
+
+        @return List of vertices
+        """
+        visited = bytearray(self.num_vertices)
+        order: List[int] = []
+        for root in itertools.chain(seeds, range(self.num_vertices)):
+            if visited[root]:
+                continue
+            visited[root] = 1
+            order.append(root)
+            act = len(order) - 1
+            while act < len(order):
+                for v in self.succ[order[act]]:
+                    if not visited[v]:
+                        visited[v] = 1
+                        order.append(v)
+                act += 1
+        return order
+
+
+    def reverse_cuthill_mckee(self) -> List[int]:
+        """!
+        Get all vertices in the reverse Cuthill-McKee order of the underlying
+        undirected graph. Each connected component is traversed in the BFS
+        order starting from a vertex of minimum degree, neighbours are visited
+        in the order of increasing degrees. Numbering vertices in this order
+        reduces the bandwidth (and the fill-in of a sparse LU) of the
+        adjacency matrix.
+
+        @return List of vertices
+        """
+        neigh = [sorted(set(self.succ[v]).union(self.pred[v]).difference((v,))) \
+            for v in range(self.num_vertices)]
+        degree = [len(n) for n in neigh]
+        visited = bytearray(self.num_vertices)
+        order: List[int] = []
+        for root in sorted(range(self.num_vertices), key=degree.__getitem__):
+            if visited[root]:
+                continue
+            visited[root] = 1
+            order.append(root)
+            act = len(order) - 1
+            while act < len(order):
+                new = [v for v in neigh[order[act]] if not visited[v]]
+                new.sort(key=degree.__getitem__)
+                for v in new:
+                    visited[v] = 1
+                order.extend(new)
+                act += 1
+        order.reverse()
+        return order
+
+
+    def strongly_connected_components(self) -> List[List[int]]:
+        """!
+        Get strongly connected components of the graph (Tarjan's algorithm,
+        without recursion). Components are returned in a reverse topological
+        order (each component precedes all components it can be reached
+        from).
+
+        @return List of components (lists of vertices)
+        """
+        index = [-1] * self.num_vertices
+        low = [0] * self.num_vertices
+        on_stack = bytearray(self.num_vertices)
+        stack: List[int] = []
+        comps: List[List[int]] = []
+        counter = 0
+
+        for root in range(self.num_vertices):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, 0)]
+            while work:
+                v, i = work[-1]
+                succ = self.succ[v]
+                if i < len(succ):
+                    work[-1] = (v, i+1)
+                    w = succ[i]
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = 1
+                        work.append((w, 0))
+                    elif on_stack[w]:
+                        low[v] = min(low[v], index[w])
+                    continue
+
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    comp = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        comp.append(w)
+                        if w == v:
+                            break
+                    comps.append(comp)
+        return comps
+
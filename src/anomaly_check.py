@@ -27,7 +27,9 @@ import csv
 import ast
 import math
 import itertools
+import hashlib
 import copy
+import functools
 from dataclasses import dataclass
 from collections import defaultdict
 from enum import Enum
@@ -36,19 +38,19 @@ from typing import List, Tuple, FrozenSet, Callable, Union
 
 import learning.fpt as fpt
 import learning.alergia as alergia
+import learning.learning_cache as learning_cache
 import wfa.core_wfa as core_wfa
 import wfa.core_wfa_export as core_wfa_export
-import wfa.matrix_wfa as matrix_wfa
+import wfa.dpa_storage as dpa_storage
+import wfa.wfa_exceptions as wfa_exceptions
 import parser.IEC104_parser as con_par
 import parser.conversation_parser_base as con_base
-import detection.distr_comparison as distr
 import detection.member as mem
 import parser.IEC104_conv_parser as iec_prep_par
 
-SPARSE = False
-
 rows_filter_normal = ["asduType", "cot"]
 DURATION = 300
+ALPHA = 0.05
 AGGREGATE = True
 ACCELERATE = False
 
@@ -100,6 +102,12 @@ class Params:
     smoothing : bool
     file_format : InputFormat
     threshold : float
+    missing : int = 1
+    minimize : bool = False
+    prune : float = None
+    stream : bool = False
+    model_cache : str = None
+    window_cache : str = None
 
 
 """
@@ -112,16 +120,18 @@ def abstraction(item: dict[str, str]) -> Tuple[str, ...]:
 """
 PA learning
 """
-def learn_proc_pa(training: List) -> core_wfa_export.CoreWFAExport:
+def learn_proc_pa(training: List, minimize: bool = False) -> core_wfa_export.CoreWFAExport:
     tree = fpt.FPT()
     tree.add_string_list(training)
-    alpha = 0.05
+    alpha = ALPHA
     if len(training) > 0:
         t0 = int(math.log(len(training), 2))
     else:
         t0 = 1
     aut = alergia.alergia(tree, alpha, t0)
     aut.rename_states()
+    if minimize:
+        return aut.normalize().minimize()
     return aut.normalize()
 
 
@@ -202,6 +212,129 @@ def learn_golden_member(parser: con_base.ConvParserBase, learn_proc: Callable, p
     return ret
 
 
+"""
+Read all messages from a csv file
+"""
+def get_file_messages(filename: str) -> List:
+    with open(filename, "r") as fd:
+        return con_par.get_messages(fd)
+
+
+"""
+Parser of messages in a given format
+"""
+def get_parser(msgs: List, file_format: InputFormat) -> con_base.ConvParserBase:
+    if file_format == InputFormat.CONV:
+        return iec_prep_par.IEC104ConvParser(msgs)
+    return con_par.IEC104Parser(msgs)
+
+
+"""
+Key of a golden model in the model cache: hash of the training traffic and of
+all parameters affecting the learning
+"""
+def model_cache_key(par: Params, alg: Algorithms) -> str:
+    digest = hashlib.sha256()
+    with open(par.normal_file, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b""):
+            digest.update(chunk)
+    learning = (rows_filter_normal, DURATION, ALPHA, "t0=log2", alg.name, par.aut_type.name, \
+        par.smoothing, par.minimize, par.file_format.name)
+    digest.update(repr(learning).encode("utf-8"))
+    return digest.hexdigest()
+
+
+"""
+Load a golden model from the model cache (None if it is not cached)
+"""
+def load_golden_map(filename: str) -> Union[dict[ComPairType, AutListType], None]:
+    if not os.path.isfile(filename):
+        return None
+    try:
+        models = dpa_storage.read_models(filename)
+    except (wfa_exceptions.WFAOperationException, ValueError, KeyError):
+        return None
+    ret: dict[ComPairType, AutListType] = defaultdict(lambda: [None])
+    for compair, dpas in models.items():
+        auts = [None if dpa is None else dpa.to_wfa() for dpa in dpas]
+        for aut in auts:
+            if aut is not None:
+                aut.__class__ = core_wfa_export.CoreWFAExport
+        ret[compair] = auts
+    return ret
+
+
+"""
+Store a golden model to the model cache
+"""
+def store_golden_map(filename: str, golden_map: dict[ComPairType, AutListType]) -> None:
+    models = dict((compair, [None if aut is None else aut.get_compiled_dpa() for aut in auts]) \
+        for compair, auts in golden_map.items())
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = "{0}.{1}.tmp".format(filename, os.getpid())
+    dpa_storage.write_models(tmp, models)
+    os.replace(tmp, filename)
+
+
+"""
+Get a golden model: load it from the model cache (if it is used and the model
+is cached) or learn it from the training traffic (and store it to the cache)
+"""
+def get_golden_map(get_parser: Callable, golden_proc: Callable, learn_proc: Callable, par: Params, alg: Algorithms) -> dict[ComPairType, AutListType]:
+    filename = None
+    if par.model_cache is not None:
+        filename = os.path.join(par.model_cache, "{0}.dpa".format(model_cache_key(par, alg)))
+        golden_map = load_golden_map(filename)
+        if golden_map is not None:
+            return golden_map
+
+    golden_map = golden_proc(get_parser(), learn_proc, par)
+    if filename is not None:
+        store_golden_map(filename, golden_map)
+    return golden_map
+
+
+"""
+Streaming member-based detection. Messages of the testing traffic are
+processed one by one; an alert is printed at the first message that leaves
+the support of the golden model.
+"""
+def detect_stream(parser: con_par.IEC104Parser, golden_map: dict[ComPairType, AutListType]) -> None:
+    stream = mem.AnomMemberStream(golden_map, abstraction, con_par.IEC104ConvTracker)
+    print("Streaming alerts: ")
+    for row in parser.input:
+        compair = frozenset([(row["srcIP"], row["srcPort"]), (row["dstIP"], row["dstPort"])])
+        for alert in stream.feed(compair, row):
+            print_stream_alert(alert)
+    for alert in stream.flush():
+        print_stream_alert(alert)
+
+
+"""
+Print an alert raised by the streaming detection
+"""
+def print_stream_alert(alert: mem.StreamAlert) -> None:
+    time = alert.message["Relative Time"] if alert.message is not None else "end"
+    reason = "unexpected message" if alert.dead_end else "incomplete conversation"
+    print("Communicating: {0}; Time: {1}; {2}: {3}".format(ent_format(alert.compair), time, reason, conv_format(alert.conversation)))
+
+
+"""
+Prune golden automata (remove items with probability lower than eps).
+Returns upper bounds of the L2 error for each communication pair.
+"""
+def prune_golden_map(golden_map: dict[ComPairType, AutListType], eps: float) -> dict[ComPairType, float]:
+    bounds: dict[ComPairType, float] = dict()
+    for compair, auts in golden_map.items():
+        bounds[compair] = 0.0
+        for i, aut in enumerate(auts):
+            if aut is None:
+                continue
+            auts[i], bound = aut.prune(eps)
+            bounds[compair] = max(bounds[compair], bound)
+    return bounds
+
+
 """
 Print help message
 """
@@ -214,6 +347,12 @@ def print_help():
     print("\t--smoothing\t\tuse smoothing (for distr only)")
     print("\t--reduced=val\t\tremove similar automata with the error upper-bound val [0,1] (for distr only)")
     print("\t--threshold=val\t\tdetect anomalies with a given threshold (for distr only)")
+    print("\t--prune=val\t\tremove transitions of golden PAs with probability lower than val")
+    print("\t--minimize\t\tminimize learned PAs (for pa only)")
+    print("\t--stream\t\tprocess messages one by one and raise alerts immediately (for member and ipfix only)")
+    print("\t--missing=val\t\tnumber of most probable missing conversations shown for anomalies (default 1)")
+    print("\t--model-cache=dir\tload golden models from (or store them to) a cache directory")
+    print("\t--window-cache=dir\tload PAs learned from windows from (or store them to) a cache directory")
     print("\t--help\t\t\tprint this message")
 
 
@@ -222,9 +361,9 @@ Distribution-comparison-based anomaly detection
 """
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hr:t:a:sf:", ["help", "reduced=", "atype=", "alg=", "smoothing", "format=", "threshold="])
+        opts, args = getopt.getopt(sys.argv[1:], "hr:t:a:sf:", ["help", "reduced=", "atype=", "alg=", "smoothing", "format=", "threshold=", "missing=", "minimize", "prune=", "stream", "model-cache=", "window-cache="])
         if len(args) > 1:
-            opts, _ = getopt.getopt(sys.argv[3:], "hr:t:a:sf:", ["help", "reduced=", "atype=", "alg=", "smoothing", "format=", "threshold="])
+            opts, _ = getopt.getopt(sys.argv[3:], "hr:t:a:sf:", ["help", "reduced=", "atype=", "alg=", "smoothing", "format=", "threshold=", "missing=", "minimize", "prune=", "stream", "model-cache=", "window-cache="])
     except getopt.GetoptError as err:
         sys.stderr.write("Error: bad parameters (try --help)\n")
         sys.exit(1)
@@ -250,6 +389,18 @@ def main():
                 golden_proc = learn_golden_member
         elif o in ("--threshold"):
             par.threshold = float(a)
+        elif o == "--missing":
+            par.missing = int(a)
+        elif o == "--minimize":
+            par.minimize = True
+        elif o == "--prune":
+            par.prune = float(a)
+        elif o == "--stream":
+            par.stream = True
+        elif o == "--model-cache":
+            par.model_cache = a
+        elif o == "--window-cache":
+            par.window_cache = a
         elif o == "--smoothing":
             par.smoothing = True
         elif o in ("-h", "--help"):
@@ -266,37 +417,45 @@ def main():
             sys.stderr.write("Error: bad parameters (try --help)\n")
             sys.exit(1)
 
+    if par.stream and (par.alg != Algorithms.MEMBER or par.file_format != InputFormat.IPFIX):
+        sys.stderr.write("Streaming detection is supported for member detection on ipfix data only\n")
+        sys.exit(1)
+    if par.minimize and par.aut_type == AutType.PA:
+        learn_proc = functools.partial(learn_proc_pa, minimize=True)
+    #Windows with the same conversations share the learned PA
+    learn_proc = learning_cache.LearningCache(learn_proc, directory=par.window_cache, \
+        tag=repr((rows_filter_normal, ALPHA, "t0=log2", par.aut_type.name, par.minimize)))
+
     if len(args) < 3:
         sys.stderr.write("Missing input files (try --help)\n")
         sys.exit(1)
     par.normal_file = sys.argv[1]
     par.test_file = sys.argv[2]
 
-    try:
-        normal_fd = open(par.normal_file, "r")
-        normal_msgs = con_par.get_messages(normal_fd)
-        test_fd = open(par.test_file, "r")
-        test_msgs = con_par.get_messages(test_fd)
-        normal_fd.close()
-        test_fd.close()
-    except FileNotFoundError:
+    if not os.path.isfile(par.normal_file) or not os.path.isfile(par.test_file):
         sys.stderr.write("Cannot open input files\n")
         sys.exit(1)
-
-    if par.file_format == InputFormat.IPFIX:
-        normal_parser = con_par.IEC104Parser(normal_msgs)
-        test_parser = con_par.IEC104Parser(test_msgs)
-    elif par.file_format == InputFormat.CONV:
-        normal_parser = iec_prep_par.IEC104ConvParser(normal_msgs)
-        test_parser = iec_prep_par.IEC104ConvParser(test_msgs)
+    with open(par.test_file, "r") as test_fd:
+        test_msgs = con_par.get_messages(test_fd)
+    test_parser = get_parser(test_msgs, par.file_format)
+    #The training traffic is parsed only if a golden model is not cached
+    normal_parser = functools.lru_cache(maxsize=None)(lambda: get_parser(get_file_messages(par.normal_file), par.file_format))
 
     try:
-        golden_map = golden_proc(normal_parser, learn_proc, par)
+        golden_map = get_golden_map(normal_parser, golden_proc, learn_proc, par, par.alg)
     except KeyError as e:
         sys.stderr.write("Missing column in the input csv: {0}\n".format(e))
         sys.exit(1)
 
+    if par.prune is not None:
+        print("Pruning error bounds: ")
+        for k, v in prune_golden_map(golden_map, par.prune).items():
+            print("{0} | {1}".format(ent_format(k), v))
+        print()
+
     if par.alg == Algorithms.DISTR:
+        #Linear algebra (scipy) is needed by the distribution comparison only
+        import detection.distr_comparison as distr
         anom = distr.AnomDistrComparison(golden_map, learn_proc)
         anom.remove_identical()
         if par.reduced is not None:
@@ -308,10 +467,14 @@ def main():
     elif par.alg == Algorithms.MEMBER:
         anom = mem.AnomMember(golden_map, learn_proc)
 
+    if par.stream:
+        detect_stream(test_parser, golden_map)
+        return
+
 
     anomalies = defaultdict(lambda: dict())
     if (par.alg == Algorithms.DISTR) and (par.threshold is not None):
-        golden_map_member = learn_golden_member(normal_parser, learn_proc, par)
+        golden_map_member = get_golden_map(normal_parser, learn_golden_member, learn_proc, par, Algorithms.MEMBER)
         anom_member = mem.AnomMember(golden_map_member, learn_proc)
     res = defaultdict(lambda: [])
     test_com = test_parser.split_communication_pairs()
@@ -370,12 +533,15 @@ def main():
                 #aut.__class__ = core_wfa_export.CoreWFAExport
                 #print(aut.to_dot())
 
-                print("Missing conversation:")
+                print("Missing conversations:")
                 if det.model_aut is None:
                     print("empty model")
                 else:
-                    word, pr = det.model_aut.difference_dwfa(det.test_aut).get_most_probable_string()
-                    print(conv_format(word), pr)
+                    missing = det.model_aut.get_k_most_probable_difference(det.test_aut, par.missing)
+                    if len(missing) == 0:
+                        print("none")
+                    for word, pr in missing:
+                        print(conv_format(word), pr)
 
                 print()
 
@@ -30,13 +30,12 @@ import math
 import detection.anom_detect_base as anom
 import wfa.core_wfa_export as core_wfa_export
 import wfa.matrix_wfa as matrix_wfa
+import wfa.array_wfa as array_wfa
+import wfa.linear_solvers as linear_solvers
 import algorithms.distance as dist
 import wfa.core_wfa as core_wfa
 
-from typing import Callable, List, no_type_check
-
-## Use sparse matrices to comput the Euclid distance
-SPARSE = False
+from typing import Callable, List, Optional, Tuple, Union, no_type_check
 
 class AnomDistrComparison(anom.AnomDetectBase):
     """!
@@ -44,18 +43,24 @@ class AnomDistrComparison(anom.AnomDetectBase):
     """
 
 
-    def __init__(self, aut_map: dict[anom.ComPairType, List[core_wfa.CoreWFA]], learning_procedure: Callable):
+    def __init__(self, aut_map: dict[anom.ComPairType, List[core_wfa.CoreWFA]], learning_procedure: Callable, inner: matrix_wfa.InnerProduct=matrix_wfa.InnerProduct.product):
         """!
         Constructor
 
         @param aut_map: Mapping of communication pairs to automata representing normal behavior
         @param learning_procedure: procedure used to obtain a PA from a list of messages
+        @param inner: Method for computing inner products (InnerProduct)
         """
         ## Mapping of communication pairs to automata representing normal behavior
         self.golden_map = aut_map
         ## Procedure used to obtain a PA from a list of messages
         self.learning_proc = learning_procedure
         self.test_fa = None
+        ## Method for computing inner products
+        self.inner = inner
+        ## Cache of golden automata: id -> (automaton, array-backed automaton,
+        ## inner product with itself)
+        self._golden_cache: dict[int, Tuple[core_wfa.CoreWFA, array_wfa.ArrayWFA, Optional[float]]] = dict()
 
 
 
@@ -85,25 +90,111 @@ class AnomDistrComparison(anom.AnomDetectBase):
         @return List of floats representing distance between golden automata and a window
         """
         auts = self.dpa_selection(window, compair)
-        ret = []
         self.test_fa = self.learning_proc(window)
 
-        for aut in auts:
-            val = self.apply_detection(aut, window, compair)
-            ret.append(val)
+        ret = None
+        if self.inner == matrix_wfa.InnerProduct.product:
+            try:
+                ret = self.batch_detection(auts, window)
+            except ValueError:
+                ret = None
+        if ret is None:
+            ret = [self.apply_detection(aut, window, compair) for aut in auts]
 
+        for i, val in enumerate(ret):
             if val <= accelerate:
-                return ret
+                return ret[:i+1]
+        return ret
 
+
+    def batch_detection(self, auts: List[core_wfa.CoreWFA], window: List) -> List[float]:
+        """!
+        Compute Euclid distances of all golden automata and the automaton of
+        the current window (self.test_fa) at once. Distances of tree-shaped
+        automata (PTAs) are computed directly from their finite distributions.
+        Inner products of the other needed products are obtained from a single
+        block-diagonal system (inner products of golden automata with
+        themselves are cached).
+
+        @param auts: Golden automata
+        @param window: List of messages corresponding to a single window
+
+        @return List of distances (in the order of auts)
+        """
+        ret: List[Optional[float]] = [AnomDistrComparison._trivial_distance(aut, self.test_fa, window) for aut in auts]
+        test_dist = self.test_fa.get_finite_distribution()
+        if test_dist is not None:
+            for i, aut in enumerate(auts):
+                dist = aut.get_finite_distribution() if ret[i] is None else None
+                if dist is not None:
+                    ret[i] = AnomDistrComparison.distribution_distance(test_dist, dist)
+
+        todo = [i for i, val in enumerate(ret) if val is None]
+        if len(todo) == 0:
+            return ret
+
+        test = array_wfa.ArrayWFA.from_wfa(self.test_fa)
+        pairs = [(test, test)]
+        entries = []
+        for i in todo:
+            entry = self._golden_cache.get(id(auts[i]))
+            if entry is None or entry[0] is not auts[i]:
+                entry = (auts[i], array_wfa.ArrayWFA.from_wfa(auts[i]), None)
+                self._golden_cache[id(auts[i])] = entry
+            entries.append(entry)
+            pairs.append((test, entry[1]))
+            if entry[2] is None:
+                pairs.append((entry[1], entry[1]))
+
+        prods = iter(matrix_wfa.MatrixWFA.compute_array_inner_products(pairs).tolist())
+        test_norm = next(prods)
+        for i, entry in zip(todo, entries):
+            mixed = next(prods)
+            norm = entry[2]
+            if norm is None:
+                norm = next(prods)
+                self._golden_cache[id(entry[0])] = (entry[0], entry[1], norm)
+            ret[i] = min(1.0, math.sqrt(max(0.0, test_norm - 2*mixed + norm)))
         return ret
 
 
-    def remove_identical(self) -> None:
+    @staticmethod
+    def _trivial_distance(aut: Optional[core_wfa.CoreWFA], test_fa: core_wfa.CoreWFA, window: List) -> Optional[float]:
         """!
-        Remove identical automata from the golden map
+        Get the distance of a golden automaton and the automaton of a window
+        in cases that do not need any computation.
+
+        @param aut: Golden automaton
+        @param test_fa: Automaton of the window
+        @param window: List of messages corresponding to the window
+
+        @return Distance (None if it has to be computed)
+        """
+        if aut is None:
+            return 0.0 if len(window) == 0 else 1.0
+        if len(window) == 0 and len(aut.get_transitions()) > 1:
+            return 1.0
+        if (len(aut.get_transitions()) > 0) != (len(test_fa.get_transitions()) > 0):
+            return 1.0
+        return None
+
+
+    def remove_identical(self, tolerance: float=0.0) -> None:
+        """!
+        Remove identical automata from the golden map. Deterministic automata
+        are compared according to their canonical keys (isomorphic automata
+        are identical).
+
+        @param tolerance: Weight tolerance used for comparing automata
         """
         for k, v in self.golden_map.items():
-            self.golden_map[k] = list(set(v))
+            uniq = dict()
+            for aut in v:
+                key = aut
+                if aut is not None and aut.is_deterministic():
+                    key = aut.get_canonical_key(tolerance)
+                uniq.setdefault(key, aut)
+            self.golden_map[k] = list(uniq.values())
 
 
     def remove_euclid_similar(self, max_error: float) -> None:
@@ -143,43 +234,120 @@ class AnomDistrComparison(anom.AnomDetectBase):
 
     @staticmethod
     @no_type_check
-    def euclid_distance(aut1: core_wfa.CoreWFA, aut2: core_wfa.CoreWFA) -> float:
+    def euclid_distance(aut1: core_wfa.CoreWFA, aut2: core_wfa.CoreWFA, backend: linear_solvers.SolverBackend=linear_solvers.SolverBackend.auto, inner: matrix_wfa.InnerProduct=matrix_wfa.InnerProduct.product, order: core_wfa.StateOrder=core_wfa.StateOrder.bfs) -> float:
         """!
         Compute Euclid distance between two automata
 
         @param aut1: First PA
         @param aut2: Second PA
+        @param backend: Solver backend used for language weights of products
+        @param inner: Method for computing inner products (InnerProduct)
+        @param order: Numbering of product states (StateOrder.bfs or
+            StateOrder.rcm)
 
         @return Euclid distance of aut1 and aut2
         """
+        if inner == matrix_wfa.InnerProduct.stein:
+            return AnomDistrComparison.stein_euclid_distance(aut1, aut2)
+        if isinstance(aut1, array_wfa.ArrayWFA) or isinstance(aut2, array_wfa.ArrayWFA):
+            return AnomDistrComparison.array_euclid_distance(aut1, aut2, backend)
+
+        dist1, dist2 = aut1.get_finite_distribution(), aut2.get_finite_distribution()
+        if dist1 is not None and dist2 is not None:
+            return AnomDistrComparison.distribution_distance(dist1, dist2)
+
         if ((len(aut1.get_transitions()) > 0 and len(aut2.get_transitions()) == 0)) or \
             ((len(aut1.get_transitions()) == 0 and len(aut2.get_transitions()) > 0)):
             return 1.0
 
-        pr1 = aut1.product(aut1).get_trim_automaton()
-        pr2 = aut1.product(aut2).get_trim_automaton()
-        pr3 = aut2.product(aut2).get_trim_automaton()
-
-        pr1.rename_states()
-        pr2.rename_states()
-        pr3.rename_states()
+        pr1 = aut1.product(aut1, trim=True, rename=True, order=order)
+        pr2 = aut1.product(aut2, trim=True, rename=True, order=order)
+        pr3 = aut2.product(aut2, trim=True, rename=True, order=order)
 
         pr1.__class__ = matrix_wfa.MatrixWFA
         pr2.__class__ = matrix_wfa.MatrixWFA
         pr3.__class__ = matrix_wfa.MatrixWFA
 
         try:
-            res1 = pr1.compute_language_probability(matrix_wfa.ClosureMode.inverse, SPARSE)
-            res2 = pr2.compute_language_probability(matrix_wfa.ClosureMode.inverse, SPARSE)
-            res3 = pr3.compute_language_probability(matrix_wfa.ClosureMode.inverse, SPARSE)
+            res1 = pr1.compute_language_probability(matrix_wfa.ClosureMode.solve, True, backend=backend)
+            res2 = pr2.compute_language_probability(matrix_wfa.ClosureMode.solve, True, backend=backend)
+            res3 = pr3.compute_language_probability(matrix_wfa.ClosureMode.solve, True, backend=backend)
         except ValueError:
-            res1 = pr1.compute_language_probability(matrix_wfa.ClosureMode.iterations, SPARSE, 20)
-            res2 = pr2.compute_language_probability(matrix_wfa.ClosureMode.iterations, SPARSE, 20)
-            res3 = pr3.compute_language_probability(matrix_wfa.ClosureMode.iterations, SPARSE, 20)
+            res1 = pr1.compute_language_probability(matrix_wfa.ClosureMode.iterations, True, 20)
+            res2 = pr2.compute_language_probability(matrix_wfa.ClosureMode.iterations, True, 20)
+            res3 = pr3.compute_language_probability(matrix_wfa.ClosureMode.iterations, True, 20)
 
         return min(1.0, math.sqrt(max(0.0, res1 - 2*res2 + res3)))
 
 
+    @staticmethod
+    def distribution_distance(dist1: dict[tuple, float], dist2: dict[tuple, float]) -> float:
+        """!
+        Compute Euclid distance between two finite distributions of words
+        (obtained, e.g., from prefix tree acceptors).
+
+        @param dist1: First distribution (Dictionary: Word -> weight)
+        @param dist2: Second distribution (Dictionary: Word -> weight)
+
+        @return Euclid distance of dist1 and dist2
+        """
+        res = sum((w - dist2.get(word, 0.0))**2 for word, w in dist1.items())
+        res += sum(w**2 for word, w in dist2.items() if word not in dist1)
+        return min(1.0, math.sqrt(res))
+
+
+    @staticmethod
+    def stein_euclid_distance(aut1: Union[core_wfa.CoreWFA, array_wfa.ArrayWFA], aut2: Union[core_wfa.CoreWFA, array_wfa.ArrayWFA]) -> float:
+        """!
+        Compute Euclid distance between two automata using inner products
+        obtained from the Stein equation (no product automaton is built).
+
+        @param aut1: First PA
+        @param aut2: Second PA
+
+        @return Euclid distance of aut1 and aut2
+        """
+        if not isinstance(aut1, array_wfa.ArrayWFA):
+            aut1 = array_wfa.ArrayWFA.from_wfa(aut1)
+        if not isinstance(aut2, array_wfa.ArrayWFA):
+            aut2 = array_wfa.ArrayWFA.from_wfa(aut2)
+        if (aut1.num_transitions() > 0) != (aut2.num_transitions() > 0):
+            return 1.0
+
+        res = [matrix_wfa.MatrixWFA.compute_stein_inner_product(a, b) for a, b in [(aut1, aut1), (aut1, aut2), (aut2, aut2)]]
+        return min(1.0, math.sqrt(max(0.0, res[0] - 2*res[1] + res[2])))
+
+
+    @staticmethod
+    def array_euclid_distance(aut1: Union[core_wfa.CoreWFA, array_wfa.ArrayWFA], aut2: Union[core_wfa.CoreWFA, array_wfa.ArrayWFA], backend: linear_solvers.SolverBackend=linear_solvers.SolverBackend.auto) -> float:
+        """!
+        Compute Euclid distance between two automata using the array-backed
+        representation (products and matrices are built from arrays).
+
+        @param aut1: First PA
+        @param aut2: Second PA
+        @param backend: Solver backend used for language weights of products
+
+        @return Euclid distance of aut1 and aut2
+        """
+        if not isinstance(aut1, array_wfa.ArrayWFA):
+            aut1 = array_wfa.ArrayWFA.from_wfa(aut1)
+        if not isinstance(aut2, array_wfa.ArrayWFA):
+            aut2 = array_wfa.ArrayWFA.from_wfa(aut2)
+        if (aut1.num_transitions() > 0) != (aut2.num_transitions() > 0):
+            return 1.0
+
+        res = []
+        for a, b in [(aut1, aut1), (aut1, aut2), (aut2, aut2)]:
+            pr = a.product(b, trim=True)
+            try:
+                res.append(matrix_wfa.MatrixWFA.compute_array_language_probability(pr, matrix_wfa.ClosureMode.solve, True, backend=backend))
+            except ValueError:
+                res.append(matrix_wfa.MatrixWFA.compute_array_language_probability(pr, matrix_wfa.ClosureMode.iterations, True, 20))
+
+        return min(1.0, math.sqrt(max(0.0, res[0] - 2*res[1] + res[2])))
+
+
     def apply_detection(self, aut: core_wfa.CoreWFA, window: List, compair: anom.ComPairType) -> float:
         """!
         Apply distribution-comparison-based anomaly detection.
@@ -200,11 +368,9 @@ class AnomDistrComparison(anom.AnomDetectBase):
 
         d = None
         try:
-            d = AnomDistrComparison.euclid_distance(aut, self.test_fa)
+            d = AnomDistrComparison.euclid_distance(aut, self.test_fa, inner=self.inner)
         except ValueError:
-            SPARSE = True
-            d = AnomDistrComparison.euclid_distance(self.test_fa, aut)
-            SPARSE = False
+            d = AnomDistrComparison.euclid_distance(self.test_fa, aut, linear_solvers.SolverBackend.sparse_direct)
         return d
 
 """ @} """
@@ -29,10 +29,11 @@
 import math
 import detection.anom_detect_base as anom
 import wfa.core_wfa_export as core_wfa_export
-import wfa.matrix_wfa as matrix_wfa
 import wfa.core_wfa as core_wfa
+import wfa.compiled_dpa as compiled_dpa
+import parser.conversation_parser_base as con_base
 
-from typing import Callable, List, no_type_check
+from typing import Callable, List, NamedTuple, Optional, Any, no_type_check
 
 class AnomMember(anom.AnomDetectBase):
     """!
@@ -96,10 +97,140 @@ class AnomMember(anom.AnomDetectBase):
         if aut is None:
             return window
 
-        ret = []
-        for conv in window:
-            prob = aut.string_prob_deterministic(conv)
-            if prob is None:
-                ret.append(conv)
+        accepted = aut.get_compiled_dpa().accepted_many(window)
+        return [conv for conv, acc in zip(window, accepted) if not acc]
 
-        return ret
+
+
+class StreamAlert(NamedTuple):
+    """!
+    Alert raised by the streaming member-based detection
+    """
+    ## Pair of communicating devices
+    compair: anom.ComPairType
+    ## Message raising the alert
+    message: Any
+    ## Prefix of the conversation (abstracted messages) read so far
+    conversation: List
+    ## True -- the prefix left the support of the models, False -- the
+    ## completed conversation is not accepted
+    dead_end: bool
+
+
+
+class AnomMemberStream:
+    """!
+    Member-based anomaly detection processing messages one by one. For each
+    communication pair, the open conversation is read by cursors of the
+    golden DPAs; an alert is raised at the first message that leaves the
+    support of all golden DPAs (without waiting for the end of the window).
+    """
+
+    def __init__(self, aut_map: dict[anom.ComPairType, List[core_wfa.CoreWFA]], abstraction: Callable, tracker_factory: Callable):
+        """!
+        Constructor
+
+        @param aut_map: Mapping of communication pairs to deterministic
+            automata representing normal behavior
+        @param abstraction: Abstraction on messages
+        @param tracker_factory: Procedure creating a tracker splitting a stream
+            of messages into conversations (e.g., IEC104ConvTracker)
+        """
+        ## Mapping of communication pairs to automata representing normal behavior
+        self.golden_map = aut_map
+        ## Abstraction on messages
+        self.abstraction = abstraction
+        ## Procedure creating conversation trackers
+        self.tracker_factory = tracker_factory
+        self._trackers: dict[anom.ComPairType, Any] = dict()
+        self._cursors: dict[anom.ComPairType, List[compiled_dpa.DPACursor]] = dict()
+        self._convs: dict[anom.ComPairType, List] = dict()
+        self._reported: dict[anom.ComPairType, bool] = dict()
+
+
+    def _new_cursors(self, compair: anom.ComPairType) -> List[compiled_dpa.DPACursor]:
+        """!
+        Get cursors of all golden DPAs of a communication pair.
+
+        @param compair: Pair of communicating devices
+
+        @return List of cursors (empty if there is no model)
+        """
+        auts = self.golden_map.get(compair, [])
+        return [aut.get_compiled_dpa().cursor() for aut in auts if aut is not None]
+
+
+    def _close(self, compair: anom.ComPairType, row: Any) -> Optional[StreamAlert]:
+        """!
+        Close the open conversation of a communication pair.
+
+        @param compair: Pair of communicating devices
+        @param row: Message completing the conversation
+
+        @return Alert if the conversation is not accepted by any model
+        """
+        conv = self._convs.pop(compair, None)
+        cursors = self._cursors.pop(compair, [])
+        reported = self._reported.pop(compair, False)
+        if conv is None or reported or any(c.is_accepting() for c in cursors):
+            return None
+        return StreamAlert(compair, row, conv, False)
+
+
+    def feed(self, compair: anom.ComPairType, row: Any) -> List[StreamAlert]:
+        """!
+        Process a following message of the communication pair.
+
+        @param compair: Pair of communicating devices
+        @param row: Message
+
+        @return List of alerts raised by the message
+        """
+        tracker = self._trackers.get(compair)
+        if tracker is None:
+            tracker = self.tracker_factory()
+            self._trackers[compair] = tracker
+        role = tracker.push(row)
+        sym = self.abstraction(row)
+        alerts = []
+
+        if role & con_base.MsgRole.DETACHED:
+            cursors = self._new_cursors(compair)
+            alive = [c.advance(sym) for c in cursors]
+            if not any(c.is_accepting() for c in cursors):
+                alerts.append(StreamAlert(compair, row, [sym], not any(alive)))
+            return alerts
+
+        if role & con_base.MsgRole.START:
+            alert = self._close(compair, row)
+            if alert is not None:
+                alerts.append(alert)
+            self._cursors[compair] = self._new_cursors(compair)
+            self._convs[compair] = []
+            self._reported[compair] = False
+
+        self._convs[compair].append(sym)
+        alive = [c.advance(sym) for c in self._cursors[compair]]
+        if not any(alive) and not self._reported[compair]:
+            self._reported[compair] = True
+            alerts.append(StreamAlert(compair, row, list(self._convs[compair]), True))
+
+        if role & con_base.MsgRole.END:
+            alert = self._close(compair, row)
+            if alert is not None:
+                alerts.append(alert)
+        return alerts
+
+
+    def flush(self) -> List[StreamAlert]:
+        """!
+        Close all open conversations (end of the stream).
+
+        @return List of alerts raised by incomplete conversations
+        """
+        alerts = []
+        for compair in list(self._convs.keys()):
+            alert = self._close(compair, None)
+            if alert is not None:
+                alerts.append(alert)
+        return alerts
@@ -21,13 +21,15 @@
     If not, see <http://www.gnu.org/licenses/>.
 """
 
+import io
 import copy
 from dataclasses import dataclass
 from collections import defaultdict
-from typing import List, Set, Union, Optional, Tuple, no_type_check, TypeVar, Generic
+from typing import List, Set, Union, Optional, Tuple, no_type_check, TypeVar, Generic, TextIO
 
 import wfa.core_wfa as core_wfa
 import wfa.core_wfa_export as core_wfa_export
+import algorithms.reachability as reachability
 
 SymbolType = TypeVar("SymbolType")
 StateType = str
@@ -236,6 +238,34 @@ class FFA:
         return succ
 
 
+    def _get_reachability(self) -> Tuple[List[StateType], dict[StateType, int], reachability.Reachability]:
+        """!
+        Get the integer-indexed transition graph of the FFA
+
+        @return Triple (list of states, State -> index, reachability graph)
+        """
+        states = list(self._states | set(self._ini.keys()))
+        index = dict((st, i) for i, st in enumerate(states))
+        edges = []
+        for src, tr_dest in self._trans.items():
+            for _, dst in tr_dest.items():
+                if isinstance(dst, set):
+                    for tr in dst:
+                        edges.append((tr.src, tr.dest))
+                else:
+                    edges.append((dst.src, dst.dest))
+        for src, dest in edges:
+            if src not in index:
+                index[src] = len(states)
+                states.append(src)
+            if dest not in index:
+                index[dest] = len(states)
+                states.append(dest)
+        reach = reachability.Reachability(len(states), \
+            ((index[src], index[dest]) for src, dest in edges))
+        return states, index, reach
+
+
     def reachable_states(self, st_set: Set[StateType]) -> Set[StateType]:
         """!
         Get all reachable states from st_set
@@ -244,15 +274,9 @@ class FFA:
 
         @return Set of reachable states
         """
-
-        succ: Set[StateType] = st_set
-        head: Set[StateType] = st_set
-        
-        while len(head) > 0:
-            new_set = self.successors_set(head)
-            head = new_set - succ
-            succ = succ | new_set
-        return succ
+        states, index, reach = self._get_reachability()
+        marks = reach.forward(index[st] for st in st_set if st in index)
+        return set(st for st, m in zip(states, marks) if m) | st_set
 
 
     def merge_states(self, states: Set[StateType]) -> None:
@@ -385,39 +409,46 @@ class FFA:
         @param legend: Legend to be print in the figure
         @return Graphwiz format of the automaton
         """
-        dot = str()
-        dot += "digraph \" Automat \" {\n    rankdir=LR;\n"
+        out = io.StringIO()
+        self.write_graphiwiz(out, legend)
+        return out.getvalue()
+
+
+    def write_graphiwiz(self, out: TextIO, legend: str=None):
+        """!
+        Write the WFA in graphwiz format (for graphical visualization) to a
+        file object. The output is written in chunks.
+
+        @param out: File object
+        @param legend: Legend to be print in the figure
+        """
+        writer = core_wfa_export.ChunkedWriter(out)
+        writer.write("digraph \" Automat \" {\n    rankdir=LR;\n")
         if legend is not None:
-            dot += "{{ rank = LR\n Legend [shape=none, margin=0, label=\"{0}\"] }}\n".format(legend)
-        dot += "node [shape = doublecircle];\n"
-        if len(self._fin) > 0:
-            for state, weight in self._fin.items():
-                dot += "\"" + str(state) + "\"" + " [label=\"" \
-                    + str(state) + ", " \
-                    + str(weight) + "\"]"
-                dot += ";\n"
-
-        dot += "node [shape = circle];\n"
+            writer.write("{{ rank = LR\n Legend [shape=none, margin=0, label=\"{0}\"] }}\n".format(legend))
+        writer.write("node [shape = doublecircle];\n")
+        for state, weight in self._fin.items():
+            writer.write("\"{0}\" [label=\"{0}, {1}\"];\n".format(state, weight))
+
+        writer.write("node [shape = circle];\n")
         for state in self._states:
             if state not in self._fin:
-                dot += "\"" + str(state) + "\"" + " [label=\"" \
-                    + str(state) + "\"]"
-                dot += ";\n"
+                writer.write("\"{0}\" [label=\"{0}\"];\n".format(state))
 
         for state, weight in self._ini.items():
-            dot += "\"init{0}\" [label=\"{1}\",shape=plaintext];".format(state, weight)
-            dot += "\"init{0}\" -> \"{1}\";\n".format(state, state)
+            writer.write("\"init{0}\" [label=\"{1}\",shape=plaintext];".format(state, weight))
+            writer.write("\"init{0}\" -> \"{1}\";\n".format(state, state))
 
         for _, tr_dest in self._trans.items():
             for sym, dst in tr_dest.items():
                 if isinstance(dst, set):
                     for tr in dst:
-                        dot += self._print_transition(tr.src, tr.dest, tr.symbol, tr.weight)
+                        writer.write(self._print_transition(tr.src, tr.dest, tr.symbol, tr.weight))
                 else:
-                    dot += self._print_transition(dst.src, dst.dest, dst.symbol, dst.weight)
+                    writer.write(self._print_transition(dst.src, dst.dest, dst.symbol, dst.weight))
 
-        dot += "}"
-        return dot
+        writer.write("}")
+        writer.flush()
 
 
     def _print_transition(self, src: StateType, dest: StateType, sym: str, weight: float) -> str:
@@ -431,13 +462,7 @@ class FFA:
 
         @return Graphwiz format
         """
-        dot = str()
-        dot += "\"" + str(src) + "\""
-        dot += " -> "
-        dot += "\"" + str(dest) + "\""
-        dot += " [ label = \"" + str(sym) + " : " + str(weight)
-        dot += "\" ];\n"
-        return dot
+        return "\"{0}\" -> \"{1}\" [ label = \"{2} : {3}\" ];\n".format(src, dest, sym, weight)
 
 
     def to_wfa(self) -> core_wfa_export.CoreWFAExport:
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""!
+\brief Cache of PAs learned from windows of conversations
+
+\details
+    Bounded LRU cache in front of a learning procedure. Learned PAs are keyed
+    by a hash of the multiset of conversations of a window (the order of
+    conversations does not matter), so a window repeating a previous one
+    reuses the previously learned PA. Learned PAs can be persisted to a
+    directory in the binary DPA format and reused by subsequent runs. Learned
+    PAs are shared and must not be modified by callers.
+
+\author Vojtěch Havlena
+
+\copyright
+    Copyright (C) 2020  Vojtech Havlena, <ihavlena@fit.vutbr.cz>\n
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.\n
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.\n
+    You should have received a copy of the GNU General Public License.
+    If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import hashlib
+import wfa.core_wfa_export as core_wfa_export
+import wfa.dpa_storage as dpa_storage
+import wfa.wfa_exceptions as wfa_exceptions
+
+from collections import Counter, OrderedDict
+from typing import Callable, List, Optional
+
+## Default number of PAs kept in the memory
+CAPACITY = 256
+
+
+class LearningCache:
+    """!
+    Bounded LRU cache of PAs learned from windows of conversations
+    """
+
+    def __init__(self, learning_procedure: Callable, capacity: int=CAPACITY, directory: Optional[str]=None, tag: str=""):
+        """!
+        Constructor
+
+        @param learning_procedure: Procedure used to obtain a PA from a list of conversations
+        @param capacity: Maximum number of PAs kept in the memory
+        @param directory: Directory for persisting learned PAs (None = no persistence)
+        @param tag: Identification of the learning procedure and its
+            parameters (part of the key of persisted PAs)
+        """
+        ## Procedure used to obtain a PA from a list of conversations
+        self.learning_proc = learning_procedure
+        ## Maximum number of PAs kept in the memory
+        self.capacity = capacity
+        ## Directory for persisting learned PAs
+        self.directory = directory
+        ## Identification of the learning procedure
+        self.tag = tag
+        ## Number of windows whose PA was found in the memory or directory
+        self.hits = 0
+        ## Number of windows whose PA was learned
+        self.misses = 0
+        self._cache: OrderedDict[str, core_wfa_export.CoreWFAExport] = OrderedDict()
+
+
+    @staticmethod
+    def window_key(window: List, tag: str="") -> str:
+        """!
+        Get a canonical hash of the multiset of conversations of a window.
+
+        @param window: List of conversations
+        @param tag: Identification of the learning procedure
+
+        @return Hexadecimal key
+        """
+        counts = sorted((repr(tuple(conv)), cnt) for conv, cnt in \
+            Counter(tuple(conv) for conv in window).items())
+        return hashlib.sha256(repr((tag, counts)).encode("utf-8")).hexdigest()
+
+
+    def __call__(self, window: List) -> core_wfa_export.CoreWFAExport:
+        """!
+        Get a PA learned from a window (learn it if the window is not cached).
+
+        @param window: List of conversations
+
+        @return Learned PA
+        """
+        key = LearningCache.window_key(window, self.tag)
+        aut = self._cache.get(key)
+        if aut is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return aut
+
+        aut = self._load(key)
+        if aut is None:
+            self.misses += 1
+            aut = self.learning_proc(window)
+            self._store(key, aut)
+        else:
+            self.hits += 1
+
+        self._cache[key] = aut
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        return aut
+
+
+    def _filename(self, key: str) -> str:
+        """!
+        Get the name of the file of a persisted PA.
+
+        @param key: Key of the window
+
+        @return File name
+        """
+        return os.path.join(self.directory, "{0}.dpa".format(key))
+
+
+    def _load(self, key: str) -> Optional[core_wfa_export.CoreWFAExport]:
+        """!
+        Load a persisted PA.
+
+        @param key: Key of the window
+
+        @return Loaded PA (None if the PA is not persisted)
+        """
+        if self.directory is None or not os.path.isfile(self._filename(key)):
+            return None
+        try:
+            aut = dpa_storage.read_dpa(self._filename(key)).to_wfa()
+        except (wfa_exceptions.WFAOperationException, ValueError, KeyError):
+            return None
+        aut.__class__ = core_wfa_export.CoreWFAExport
+        return aut
+
+
+    def _store(self, key: str, aut: core_wfa_export.CoreWFAExport) -> None:
+        """!
+        Persist a learned PA (PAs that cannot be compiled are not persisted).
+
+        @param key: Key of the window
+        @param aut: Learned PA
+        """
+        if self.directory is None:
+            return
+        try:
+            dpa = aut.get_compiled_dpa()
+        except wfa_exceptions.WFAOperationException:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = "{0}.{1}.tmp".format(self._filename(key), os.getpid())
+        dpa_storage.write_dpa(tmp, dpa)
+        os.replace(tmp, self._filename(key))
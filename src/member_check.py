@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Lightweight member-based anomaly detection with stored DPAs. Golden DPAs are
+loaded from a binary model file (created by anomaly_check.py --model-cache or
+pa_learning.py) and conversations are scored by compiled DPAs only (no
+learning and no linear algebra is involved).
+
+Copyright (C) 2020  Vojtech Havlena, <ihavlena@fit.vutbr.cz>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License.
+If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import getopt
+import os.path
+
+from collections import defaultdict
+from typing import List, Tuple, FrozenSet
+
+import parser.IEC104_parser as con_par
+import parser.IEC104_conv_parser as iec_prep_par
+import wfa.dpa_storage as dpa_storage
+import wfa.wfa_exceptions as wfa_exceptions
+
+rows_filter_normal = ["asduType", "cot"]
+DURATION = 300
+
+ComPairType = FrozenSet[Tuple[str,str]]
+
+"""
+Abstraction on messages
+"""
+def abstraction(item: dict[str, str]) -> Tuple[str, ...]:
+    return tuple([item[k] for k in rows_filter_normal])
+
+
+"""
+Communication entity string format
+"""
+def ent_format(k: ComPairType) -> str:
+    [(fip, fp), (sip, sp)] = list(k)
+    return "{0}:{1} -- {2}:{3}".format(fip, fp, sip, sp)
+
+
+"""
+Conversations of a window that are not accepted by a golden DPA (all
+conversations if there is no DPA)
+"""
+def apply_detection(dpa, window: List) -> List:
+    if dpa is None:
+        return window
+    accepted = dpa.accepted_many(window)
+    return [conv for conv, acc in zip(window, accepted) if not acc]
+
+
+"""
+Print help message
+"""
+def print_help():
+    print("./member_check <model file> <inspected csv> [OPT]")
+    print("OPT are from the following: ")
+    print("\t--format=conv/ipfix\tformat of input data: conversations (conv) or csv data in ipfix format (ipfix)")
+    print("\t--help\t\t\tprint this message")
+
+
+"""
+Member-based anomaly detection with stored golden DPAs
+"""
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hf:", ["help", "format="])
+        if len(args) > 1:
+            opts, _ = getopt.getopt(sys.argv[3:], "hf:", ["help", "format="])
+    except getopt.GetoptError as err:
+        sys.stderr.write("Error: bad parameters (try --help)\n")
+        sys.exit(1)
+
+    conv_format = False
+    for o, a in opts:
+        if o in ("-f", "--format"):
+            conv_format = (a == "conv")
+        elif o in ("-h", "--help"):
+            print_help()
+            sys.exit()
+
+    if len(args) < 2:
+        sys.stderr.write("Missing input files (try --help)\n")
+        sys.exit(1)
+    model_file, test_file = sys.argv[1], sys.argv[2]
+    if not os.path.isfile(model_file) or not os.path.isfile(test_file):
+        sys.stderr.write("Cannot open input files\n")
+        sys.exit(1)
+
+    try:
+        models = dpa_storage.read_models(model_file)
+    except wfa_exceptions.WFAOperationException as e:
+        sys.stderr.write("{0}\n".format(e))
+        sys.exit(1)
+    #Models stored without a communication pair (by pa_learning) are used for all pairs
+    default = models.pop(None, [None])
+    golden_map: dict[ComPairType, List] = defaultdict(lambda: default)
+    golden_map.update(models)
+
+    with open(test_file, "r") as test_fd:
+        test_msgs = con_par.get_messages(test_fd)
+    if conv_format:
+        test_parser = iec_prep_par.IEC104ConvParser(test_msgs)
+    else:
+        test_parser = con_par.IEC104Parser(test_msgs)
+
+    res = defaultdict(lambda: [])
+    last = 0
+    try:
+        for item in test_parser.split_communication_pairs():
+            cnt = 0
+            for window in item.split_to_windows(DURATION):
+                window.parse_conversations()
+                convs = window.get_all_conversations(abstraction)
+                res[item.compair].append([apply_detection(dpa, convs) for dpa in golden_map[item.compair]])
+                last = max(cnt, last)
+                cnt += 1
+    except KeyError as e:
+        sys.stderr.write("Missing column in the input csv: {0}\n".format(e))
+        sys.exit(1)
+
+    print("Detection results: ")
+    print("{0} {1}".format(model_file, test_file))
+    for k, v in res.items():
+        print("\n"+ent_format(k))
+        for i in range(len(v)):
+            if i == last:
+                continue
+            print("{0};{1}".format(i, [ it for its in v[i] for it in its ]))
+
+
+if __name__ == "__main__":
+    main()
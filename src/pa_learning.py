@@ -24,6 +24,7 @@ import getopt
 import os
 import csv
 import math
+import functools
 from enum import Enum
 from dataclasses import dataclass
 
@@ -33,10 +34,14 @@ import learning.fpt as fpt
 import learning.alergia as alergia
 import parser.IEC104_parser as con_par
 import parser.IEC104_conv_parser as iec_prep_par
+import wfa.dpa_storage as dpa_storage
 
 ComPairType = FrozenSet[Tuple[str,str]]
 rows_filter = ["asduType", "cot"]
 TRAINING = 1.0
+#Stored DOT files are restricted to this number of states and edges
+DOT_STATES = 2000
+DOT_EDGES = 10000
 
 """
 Program parameters
@@ -62,6 +67,7 @@ class Params:
     alg : Algorithms
     file : str
     file_format : InputFormat
+    minimize : bool = False
 
 
 """
@@ -80,13 +86,14 @@ def print_help():
     print("OPT are from the following: ")
     print("\t--atype=pa/pta\t\tlearning based on PAs/PTAs (default PA)")
     print("\t--format=conv/ipfix\tformat of input file: conversations/IPFIX (default IPFIX)")
+    print("\t--minimize\t\tminimize the learned PA (for pa only)")
     print("\t--help\t\t\tprint this message")
 
 
 """
 Function for learning based on Alergia (PA)
 """
-def learn_pa(training):
+def learn_pa(training, minimize=False):
     if len(training) == 0:
         raise Exception("training set is empty")
 
@@ -99,6 +106,8 @@ def learn_pa(training):
 
     aut = alergia.alergia(tree, alpha, t0)
     aut.rename_states()
+    if minimize:
+        return aut.normalize().minimize(), alpha, t0
     return aut.normalize(), alpha, t0
 
 
@@ -133,17 +142,16 @@ def store_automata(csv_file, fa, alpha, t0, par=""):
     else:
         store_filename = "{0}{1}-pta".format(store_filename,par)
 
-    fa_fd = open("{0}.fa".format(store_filename), "w")
-    fa_fd.write(fa.to_fa_format(True))
-    fa_fd.close()
+    with open("{0}.fa".format(store_filename), "w") as fa_fd:
+        fa.write_fa_format(fa_fd, True)
+    dpa_storage.write_dpa("{0}.dpa".format(store_filename), fa.get_compiled_dpa())
 
     if (alpha is not None) and (t0 is not None):
         legend = "File: {0}, alpha: {1}, t0: {2}, {3}".format(csv_file, alpha, t0, par)
     else:
         legend = "File: {0}, {1}".format(csv_file, par)
-    dot_fd = open("{0}.dot".format(store_filename), "w")
-    dot_fd.write(fa.to_dot(aggregate=False, legend=legend))
-    dot_fd.close()
+    with open("{0}.dot".format(store_filename), "w") as dot_fd:
+        fa.write_dot(dot_fd, aggregate=False, legend=legend, max_states=DOT_STATES, max_edges=DOT_EDGES)
 
 
 """
@@ -151,9 +159,9 @@ Main
 """
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "ha:f:", ["help", "atype=", "format="])
+        opts, args = getopt.getopt(sys.argv[1:], "ha:f:", ["help", "atype=", "format=", "minimize"])
         if len(args) > 0:
-            opts, _ = getopt.getopt(args[1:], "ha:f:", ["help", "atype=", "format="])
+            opts, _ = getopt.getopt(args[1:], "ha:f:", ["help", "atype=", "format=", "minimize"])
     except getopt.GetoptError as err:
         sys.stderr.write("Error: bad parameters (try --help)\n")
         sys.exit(1)
@@ -177,10 +185,15 @@ def main():
                 params.file_format = InputFormat.CONV
             elif a == "ipfix":
                 params.file_format = InputFormat.IPFIX
+        elif o == "--minimize":
+            params.minimize = True
         else:
             sys.stderr.write("Error: unrecognized parameters (try --help)\n")
             sys.exit(1)
 
+    if params.minimize and params.alg == Algorithms.PA:
+        learn_fnc = functools.partial(learn_pa, minimize=True)
+
     if len(args) == 0:
         sys.stderr.write("Missing input file (try --help)\n")
         sys.exit(1)
@@ -225,11 +238,7 @@ def main():
         par = ent_format(compr_parser.compair)
         store_automata(csv_file, fa, alpha, t0, par)
 
-        miss = 0
-        for line in testing:
-            prob = fa.string_prob_deterministic(line)
-            if prob is None:
-                miss += 1
+        miss = len(testing) - int(fa.get_compiled_dpa().accepted_many(testing).sum())
         
         print("File: {0} {1}".format(csv_file, ent_format(compr_parser.compair)))
         if (alpha is not None) and (t0 is not None):
@@ -334,6 +334,64 @@ class IEC104Parser(par.ConvParserBase[Dict[str, str]]):
         return ret
 
 
+class IEC104ConvTracker:
+    """!
+    Incremental splitting of a stream of messages (of a single communication
+    pair) into conversations. Follows IEC104Parser.get_conversation, but
+    decides about each message as soon as it arrives (spontaneous messages
+    inside a conversation are standalone conversations).
+    """
+
+    def __init__(self):
+        """!
+        Constructor
+        """
+        ## Is there an open conversation
+        self.open = False
+        ## Type of the open conversation
+        self.tp = ConvType.UNKNOWN
+        ## Was a message from the middle range of the open conversation seen
+        self.final = False
+
+
+    def _start(self, row: ConvSymbolType) -> par.MsgRole:
+        """!
+        Start a new conversation by the message row.
+
+        @param row: Message
+
+        @return Role of the message
+        """
+        self.tp = IEC104Parser.get_initial_type(row)
+        self.final = False
+        self.open = not IEC104Parser.is_final(row, self.tp)
+        return par.MsgRole.START if self.open else par.MsgRole.START | par.MsgRole.END
+
+
+    def push(self, row: ConvSymbolType) -> par.MsgRole:
+        """!
+        Process a following message.
+
+        @param row: Message
+
+        @return Role of the message
+        """
+        if IEC104Parser.is_spontaneous(row):
+            return par.MsgRole.DETACHED if self.open else par.MsgRole.START | par.MsgRole.END
+        if not self.open:
+            return self._start(row)
+
+        if IEC104Parser.in_middle_range(row, self.tp):
+            self.final = True
+        elif self.final:
+            return self._start(row)
+        if IEC104Parser.is_final(row, self.tp):
+            self.open = False
+            return par.MsgRole.END
+        return par.MsgRole.CONTINUE
+
+
+
 def get_messages(fd) -> List[ConvSymbolType]:
     """!
     Get all messages from a csv file.
@@ -24,6 +24,7 @@
 """
 
 from abc import ABC, abstractmethod
+from enum import Flag
 
 from typing import List, Dict, TypeVar, Generic, Optional, Callable, Type
 
@@ -32,6 +33,20 @@ ItemType = TypeVar("ItemType")
 ConvBaseType = List[ItemType]
 
 
+class MsgRole(Flag):
+    """!
+    Role of a message in a stream of messages (decided by a conversation tracker)
+    """
+    ## The message is appended to the open conversation
+    CONTINUE = 0
+    ## The message starts a new conversation (the open one is closed)
+    START = 1
+    ## The message completes the open conversation
+    END = 2
+    ## The message is a standalone conversation (the open one is not affected)
+    DETACHED = 4
+
+
 class ConvParserBase(ABC, Generic[ItemType]):
     """!
     Base class for parsing conversations
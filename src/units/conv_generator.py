@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Tool generating synthetic conversations sampled from learned PAs.
+
+Copyright (C) 2020  Vojtech Havlena, <ihavlena@fit.vutbr.cz>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License.
+If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import getopt
+import numpy
+
+import pa_learning
+import parser.IEC104_parser as con_par
+import parser.IEC104_conv_parser as iec_prep_par
+
+## Time span (in seconds) of generated conversations
+DURATION = 3600.0
+
+"""
+Print help message
+"""
+def print_help():
+    print("Generate conversations sampled from PAs learned from a given traffic")
+    print()
+    print("./conv_generator <csv file> <count> [OPT]")
+    print("OPT are from the following: ")
+    print("\t--atype=pa/pta\t\tlearning based on PAs/PTAs (default PA)")
+    print("\t--format=conv/ipfix\tformat of input file: conversations/IPFIX (default IPFIX)")
+    print("\t--seed=val\t\tseed of the random number generator")
+    print("\t--duration=val\t\ttime span of generated conversations in seconds (default 3600)")
+    print("\t--help\t\t\tprint this message")
+
+
+"""
+Communication pair in the key format of conversation files
+"""
+def key_format(compair) -> str:
+    [(fip, fp), (sip, sp)] = sorted(list(compair))
+    return "{0}-{1}-{2}-{3}".format(fip, sip, fp, sp)
+
+
+"""
+Conversation in the data format of conversation files
+"""
+def data_format(conv) -> str:
+    return ",".join(["<{0}.{1}>".format(*sym) for sym in conv])
+
+
+"""
+Time in the timestamp format of conversation files
+"""
+def time_format(sec: float) -> str:
+    return "{0:02d}:{1:02d}:{2:05.2f}".format(int(sec // 3600) % 24, int(sec // 60) % 60, sec % 60)
+
+
+"""
+Generate conversations
+"""
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ha:f:", ["help", "atype=", "format=", "seed=", "duration="])
+        if len(args) > 1:
+            opts, _ = getopt.getopt(args[2:], "ha:f:", ["help", "atype=", "format=", "seed=", "duration="])
+    except getopt.GetoptError as err:
+        sys.stderr.write("Error: bad parameters (try --help)\n")
+        sys.exit(1)
+
+    learn_fnc = pa_learning.learn_pa
+    conv_format = False
+    seed = None
+    duration = DURATION
+    for o, a in opts:
+        if o in ("-a", "--atype"):
+            learn_fnc = pa_learning.learn_pta if a == "pta" else pa_learning.learn_pa
+        elif o in ("-f", "--format"):
+            conv_format = (a == "conv")
+        elif o == "--seed":
+            seed = int(a)
+        elif o == "--duration":
+            duration = float(a)
+        elif o in ("-h", "--help"):
+            print_help()
+            sys.exit()
+
+    if len(args) < 2:
+        sys.stderr.write("Missing parameters (try --help)\n")
+        sys.exit(1)
+
+    try:
+        csv_fd = open(args[0], "r")
+    except FileNotFoundError:
+        sys.stderr.write("Cannot open file: {0}\n".format(args[0]))
+        sys.exit(1)
+    count = int(args[1])
+    msgs = con_par.get_messages(csv_fd)
+    csv_fd.close()
+
+    if conv_format:
+        parser = iec_prep_par.IEC104ConvParser(msgs)
+    else:
+        parser = con_par.IEC104Parser(msgs)
+    rng = numpy.random.default_rng(seed)
+
+    out = sys.stdout
+    out.write("Timestamp;Relative Time;Duration;Length;Data\n")
+    for compr_parser in parser.split_communication_pairs():
+        compr_parser.parse_conversations()
+        training = compr_parser.get_all_conversations(pa_learning.abstraction)
+        if len(training) == 0:
+            continue
+        fa, _, _ = learn_fnc(training)
+
+        convs = fa.sample(count, rng)
+        times = numpy.sort(rng.uniform(0.0, duration, count))
+        out.write("Key;{0};\n".format(key_format(compr_parser.compair)))
+        for tm, conv in zip(times.tolist(), convs):
+            if len(conv) == 0:
+                continue
+            out.write("{0};{1};0.0;{2};{3}\n".format(time_format(tm), tm, len(conv), data_format(conv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,6 @@ import os
 from collections import defaultdict
 import learning.fpt as fpt
 import learning.alergia as alergia
-import FAdo.fa
 import detection.packet_loss as pl
 import parser.IEC104_parser as con_par
 
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+"""!
+\brief Array-backed representation of WFAs
+
+\details
+    Structure-of-arrays representation of a WFA. Sources, destinations,
+    symbols (encoded as integers) and weights of transitions are stored in
+    parallel NumPy arrays, initial and final weights in dense vectors. States
+    are numbered from 0 to n-1. Provides product and trimming working
+    directly on the arrays (without creating a Python object per transition).
+
+\author Vojtěch Havlena
+
+\copyright
+    Copyright (C) 2020  Vojtech Havlena, <ihavlena@fit.vutbr.cz>\n
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.\n
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.\n
+    You should have received a copy of the GNU General Public License.
+    If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy
+
+from typing import List, Optional, Sequence, Tuple, Any
+
+StateArrayType = numpy.ndarray
+
+
+def _expand_ranges(lo: numpy.ndarray, hi: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """!
+    Expand a list of index ranges [lo[i], hi[i]) into a flat array of indices.
+
+    @param lo: Lower bounds of the ranges
+    @param hi: Upper bounds of the ranges (exclusive)
+
+    @return Pair (indices of the ranges, flat indices)
+    """
+    counts = hi - lo
+    total = int(counts.sum())
+    owner = numpy.repeat(numpy.arange(len(lo)), counts)
+    shift = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return owner, lo[owner] + shift
+
+
+class ArrayWFA:
+    """!
+    Array-backed (structure-of-arrays) representation of a WFA
+    """
+
+    def __init__(self, src: StateArrayType, dest: StateArrayType, sym: numpy.ndarray, weight: numpy.ndarray, start: numpy.ndarray, final: numpy.ndarray, symbols: List[Any], states: Optional[List[Any]]=None):
+        """!
+        Constructor
+
+        @param src: Source states of transitions
+        @param dest: Destination states of transitions
+        @param sym: Symbols (indices to the symbol table) of transitions
+        @param weight: Weights of transitions
+        @param start: Vector of initial weights
+        @param final: Vector of final weights
+        @param symbols: Symbol table
+        @param states: Original labels of the states (None -- states are
+            labeled by their indices)
+        """
+        self.src = src
+        self.dest = dest
+        self.sym = sym
+        self.weight = weight
+        self.start = start
+        self.final = final
+        self.symbols = symbols
+        self.states = states
+
+
+    @staticmethod
+    def from_wfa(aut) -> "ArrayWFA":
+        """!
+        Convert a WFA (CoreWFA) to the array-backed representation. Initial
+        states get the lowest indices.
+
+        @param aut: WFA (CoreWFA)
+
+        @return Array-backed WFA
+        """
+        starts = list(aut.get_starts().keys())
+        start_set = set(starts)
+        states = starts + [st for st in aut.get_states() if st not in start_set]
+        st_map = dict((st, i) for i, st in enumerate(states))
+        symbols = list(dict.fromkeys(list(aut.get_alphabet()) + \
+            [tr.symbol for tr in aut.get_transitions()]))
+        sym_map = dict((s, i) for i, s in enumerate(symbols))
+
+        transitions = aut.get_transitions()
+        cnt = len(transitions)
+        src = numpy.fromiter((st_map[tr.src] for tr in transitions), dtype=numpy.int32, count=cnt)
+        dest = numpy.fromiter((st_map[tr.dest] for tr in transitions), dtype=numpy.int32, count=cnt)
+        sym = numpy.fromiter((sym_map[tr.symbol] for tr in transitions), dtype=numpy.int32, count=cnt)
+        weight = numpy.fromiter((tr.weight for tr in transitions), dtype=numpy.float64, count=cnt)
+
+        start = numpy.zeros((len(states),), dtype=numpy.float64)
+        for st, w in aut.get_starts().items():
+            start[st_map[st]] = w
+        final = numpy.zeros((len(states),), dtype=numpy.float64)
+        for st, w in aut.get_finals().items():
+            if st in st_map:
+                final[st_map[st]] = w
+        return ArrayWFA(src, dest, sym, weight, start, final, symbols, states)
+
+
+    def to_wfa(self):
+        """!
+        Convert the array-backed WFA to CoreWFA.
+
+        @return WFA (CoreWFA)
+        """
+        import wfa.core_wfa as core_wfa
+
+        labels = self.states if self.states is not None else list(range(self.num_states()))
+        transitions = [core_wfa.Transition(labels[s], labels[d], self.symbols[a], float(w)) \
+            for s, d, a, w in zip(self.src.tolist(), self.dest.tolist(), self.sym.tolist(), self.weight.tolist())]
+        starts = dict((labels[i], float(self.start[i])) for i in numpy.nonzero(self.start)[0])
+        finals = dict((labels[i], float(self.final[i])) for i in numpy.nonzero(self.final)[0])
+        return core_wfa.CoreWFA(transitions, finals, starts, list(self.symbols))
+
+
+    @staticmethod
+    def disjoint_union(auts: Sequence["ArrayWFA"]) -> Tuple["ArrayWFA", numpy.ndarray]:
+        """!
+        Get the disjoint union of array-backed WFAs (states of the i-th
+        automaton are shifted by the i-th offset).
+
+        @param auts: List of array-backed WFAs
+
+        @return Pair (union, offsets of the automata)
+        """
+        symbols = list(dict.fromkeys(sym for aut in auts for sym in aut.symbols))
+        sym_map = dict((sym, i) for i, sym in enumerate(symbols))
+        sizes = [aut.num_states() for aut in auts]
+        offsets = numpy.concatenate(([0], numpy.cumsum(sizes, dtype=numpy.int64)))
+
+        def cat(arrays: List[numpy.ndarray], dtype) -> numpy.ndarray:
+            return numpy.concatenate(arrays).astype(dtype) if arrays else numpy.zeros((0,), dtype=dtype)
+
+        src = cat([aut.src + off for aut, off in zip(auts, offsets)], numpy.int32)
+        dest = cat([aut.dest + off for aut, off in zip(auts, offsets)], numpy.int32)
+        sym = cat([numpy.array([sym_map[a] for a in aut.symbols] + [0], dtype=numpy.int32)[aut.sym] for aut in auts], numpy.int32)
+        weight = cat([aut.weight for aut in auts], numpy.float64)
+        start = cat([aut.start for aut in auts], numpy.float64)
+        final = cat([aut.final for aut in auts], numpy.float64)
+        return ArrayWFA(src, dest, sym, weight, start, final, symbols), offsets
+
+
+    def num_states(self) -> int:
+        """!
+        Get the number of states
+
+        @return Number of states
+        """
+        return len(self.start)
+
+
+    def num_transitions(self) -> int:
+        """!
+        Get the number of transitions
+
+        @return Number of transitions
+        """
+        return len(self.src)
+
+
+    def _offsets(self, keys: numpy.ndarray, size: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """!
+        Sort transitions according to keys and compute offsets of blocks with
+        the same key (CSR-like index).
+
+        @param keys: Keys of transitions (in the range 0 to size-1)
+        @param size: Number of distinct keys
+
+        @return Pair (permutation sorting the transitions, offsets of blocks)
+        """
+        order = numpy.argsort(keys, kind="stable")
+        offsets = numpy.zeros((size+1,), dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(keys, minlength=size), out=offsets[1:])
+        return order, offsets
+
+
+    def reachable(self, seeds: numpy.ndarray, forward: bool=True) -> numpy.ndarray:
+        """!
+        Get states reachable (or backward reachable) from seeds.
+
+        @param seeds: Boolean mask of the seed states
+        @param forward: Forward (True) or backward (False) reachability
+
+        @return Boolean mask of reachable states
+        """
+        fst, snd = (self.src, self.dest) if forward else (self.dest, self.src)
+        order, offsets = self._offsets(fst, self.num_states())
+        targets = snd[order]
+
+        visited = seeds.copy()
+        head = numpy.nonzero(visited)[0]
+        while len(head) > 0:
+            _, ind = _expand_ranges(offsets[head], offsets[head+1])
+            succ = numpy.unique(targets[ind])
+            head = succ[~visited[succ]]
+            visited[head] = True
+        return visited
+
+
+    def get_automata_restriction(self, keep: numpy.ndarray) -> "ArrayWFA":
+        """!
+        Get WFA restriction to only states given by the mask keep (states are
+        renumbered, preserving their order).
+
+        @param keep: Boolean mask of the states to be kept
+
+        @return Array-backed WFA (restriction)
+        """
+        index = numpy.cumsum(keep) - 1
+        tr_keep = keep[self.src] & keep[self.dest]
+        states = None
+        if self.states is not None:
+            states = [st for st, k in zip(self.states, keep.tolist()) if k]
+        return ArrayWFA(index[self.src[tr_keep]].astype(numpy.int32), \
+            index[self.dest[tr_keep]].astype(numpy.int32), self.sym[tr_keep], \
+            self.weight[tr_keep], self.start[keep], self.final[keep], \
+            self.symbols, states)
+
+
+    def get_trim_automaton(self) -> "ArrayWFA":
+        """!
+        Get trimmed WFA (only states that are both accessible and
+        coaccessible are kept). If no initial state remains, the first initial
+        state is kept.
+
+        @return Trimmed WFA
+        """
+        keep = self.get_useful_states()
+        initials = numpy.nonzero(self.start)[0]
+        if not keep[initials].any() and len(initials) > 0:
+            keep[initials[0]] = True
+        return self.get_automata_restriction(keep)
+
+
+    def product(self, aut: "ArrayWFA", trim: bool=False, seeds: Optional[Tuple[numpy.ndarray, numpy.ndarray]]=None) -> "ArrayWFA":
+        """!
+        Perform the product of two array-backed WFAs. Pairs of states are
+        explored level by level (in the BFS order); transitions of a level are
+        joined on symbols at once.
+
+        @param aut: Second automaton for the product.
+        @param trim: Return the trimmed product.
+        @param seeds: Pairs of states the exploration starts from (states of
+            self, states of aut; pairs have to be distinct). Without trimming,
+            the seeds are the first states of the product. None -- all pairs
+            of initial states.
+
+        @return Array-backed WFA representing the product (states of the
+            product are labeled by their indices)
+        """
+        nsym = len(self.symbols)
+        n2 = numpy.int64(max(aut.num_states(), 1))
+        sym_map = dict((s, i) for i, s in enumerate(self.symbols))
+        conv = numpy.array([sym_map.get(s, -1) for s in aut.symbols] + [-1], dtype=numpy.int64)
+
+        order1, offsets1 = self._offsets(self.src, self.num_states())
+        sym1 = self.sym[order1].astype(numpy.int64)
+        dest1 = self.dest[order1].astype(numpy.int64)
+        weight1 = self.weight[order1]
+
+        sym2 = conv[aut.sym] if aut.num_transitions() > 0 else numpy.zeros((0,), dtype=numpy.int64)
+        shared = sym2 >= 0
+        keys2 = aut.src[shared].astype(numpy.int64) * nsym + sym2[shared]
+        order2 = numpy.argsort(keys2, kind="stable")
+        keys2 = keys2[order2]
+        dest2 = aut.dest[shared][order2].astype(numpy.int64)
+        weight2 = aut.weight[shared][order2]
+
+        if seeds is None:
+            ini1, ini2 = numpy.nonzero(self.start)[0], numpy.nonzero(aut.start)[0]
+            head = (numpy.repeat(ini1, len(ini2)) * n2 + numpy.tile(ini2, len(ini1))).astype(numpy.int64)
+        else:
+            head = numpy.asarray(seeds[0], dtype=numpy.int64) * n2 + numpy.asarray(seeds[1], dtype=numpy.int64)
+        discovered = [head]
+        seen = numpy.sort(head)
+        tr_src, tr_dest, tr_sym, tr_weight = [], [], [], []
+
+        while len(head) > 0:
+            p, q = head // n2, head % n2
+            owner, e1 = _expand_ranges(offsets1[p], offsets1[p+1])
+            key = q[owner] * nsym + sym1[e1]
+            owner2, e2 = _expand_ranges(numpy.searchsorted(keys2, key, "left"), \
+                numpy.searchsorted(keys2, key, "right"))
+            e1 = e1[owner2]
+            dst = dest1[e1] * n2 + dest2[e2]
+            tr_src.append(head[owner[owner2]])
+            tr_dest.append(dst)
+            tr_sym.append(sym1[e1])
+            tr_weight.append(weight1[e1] * weight2[e2])
+
+            cand = numpy.unique(dst)
+            pos = numpy.searchsorted(seen, cand)
+            found = pos < len(seen)
+            found[found] = seen[pos[found]] == cand[found]
+            head = cand[~found]
+            if len(head) > 0:
+                discovered.append(head)
+                seen = numpy.sort(numpy.concatenate((seen, head)))
+
+        pairs = numpy.concatenate(discovered)
+        sorter = numpy.argsort(pairs, kind="stable")
+        sorted_pairs = pairs[sorter]
+        def pair_index(keys: numpy.ndarray) -> numpy.ndarray:
+            return sorter[numpy.searchsorted(sorted_pairs, keys)].astype(numpy.int32)
+
+        p, q = pairs // n2, pairs % n2
+        start = self.start[p] * aut.start[q] if len(pairs) > 0 else numpy.zeros((0,))
+        final = self.final[p] * aut.final[q] if len(pairs) > 0 else numpy.zeros((0,))
+        empty_int = numpy.zeros((0,), dtype=numpy.int64)
+        src = pair_index(numpy.concatenate(tr_src)) if tr_src else empty_int.astype(numpy.int32)
+        dest = pair_index(numpy.concatenate(tr_dest)) if tr_dest else empty_int.astype(numpy.int32)
+        sym = numpy.concatenate(tr_sym).astype(numpy.int32) if tr_sym else empty_int.astype(numpy.int32)
+        weight = numpy.concatenate(tr_weight) if tr_weight else numpy.zeros((0,))
+
+        ret = ArrayWFA(src, dest, sym, weight, start, final, self.symbols)
+        if trim:
+            return ret.get_trim_automaton()
+        return ret
+
+
+    def get_useful_states(self) -> numpy.ndarray:
+        """!
+        Get states that are both accessible and coaccessible.
+
+        @return Boolean mask of useful states
+        """
+        return self.reachable(self.start != 0.0) & self.reachable(self.final != 0.0, False)
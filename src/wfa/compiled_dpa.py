@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+"""!
+\brief Compiled (table-based) deterministic probabilistic automata
+
+\details
+    Immutable representation of a deterministic PA suitable for a fast scoring
+    of conversations. Symbols are encoded as integers, transitions are stored
+    in a dense next-state table and a log-weight table. A batch of
+    conversations is scored by walking the tables for all conversations at
+    once.
+
+\author Vojtěch Havlena
+
+\copyright
+    Copyright (C) 2020  Vojtech Havlena, <ihavlena@fit.vutbr.cz>\n
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.\n
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.\n
+    You should have received a copy of the GNU General Public License.
+    If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import numpy
+import wfa.wfa_exceptions as wfa_exceptions
+
+from typing import List, Optional, Sequence, Tuple, Any
+
+## Next state denoting a missing transition
+NO_STATE = -1
+## Symbol code denoting a symbol out of the alphabet
+NO_SYMBOL = -1
+
+
+class CompiledDPA:
+    """!
+    Table-based immutable representation of a deterministic PA
+    """
+
+    def __init__(self, symbols: List[Any], next_state: numpy.ndarray, log_weight: numpy.ndarray, log_final: numpy.ndarray, start: int, log_start: float):
+        """!
+        Constructor
+
+        @param symbols: Symbol table (symbol i is encoded by i)
+        @param next_state: Next-state table (states x symbols), NO_STATE for missing transitions
+        @param log_weight: Log-weight table (states x symbols)
+        @param log_final: Log-weights of final states (-inf for non-final states)
+        @param start: Index of the initial state
+        @param log_start: Log-weight of the initial state
+        """
+        self.symbols = symbols
+        self.sym_map: dict[Any, int] = dict((sym, i) for i, sym in enumerate(symbols))
+        self.next_state = next_state
+        self.log_weight = log_weight
+        self.log_final = log_final
+        self.start = start
+        self.log_start = log_start
+        self._cumulative: Optional[numpy.ndarray] = None
+
+
+    @staticmethod
+    def from_wfa(aut) -> "CompiledDPA":
+        """!
+        Compile a deterministic PA (CoreWFA). Transitions and final states
+        with a zero weight are treated as missing (a word using them has zero
+        probability).
+
+        @param aut: Deterministic PA (CoreWFA)
+
+        @return Compiled PA
+        """
+        if not aut.is_deterministic() or len(aut.get_starts()) != 1:
+            raise wfa_exceptions.WFAOperationException("Only deterministic WFA with a single initial state can be compiled.")
+
+        start_state, start_weight = next(iter(aut.get_starts().items()))
+        states = [start_state] + [st for st in aut.get_states() if st != start_state]
+        st_map = dict((st, i) for i, st in enumerate(states))
+        symbols = list(dict.fromkeys([tr.symbol for tr in aut.get_transitions()]))
+        sym_map = dict((sym, i) for i, sym in enumerate(symbols))
+
+        next_state = numpy.full((len(states), len(symbols)), NO_STATE, dtype=numpy.int32)
+        log_weight = numpy.full((len(states), len(symbols)), -numpy.inf, dtype=numpy.float64)
+        for tr in aut.get_transitions():
+            if tr.weight <= 0.0:
+                continue
+            next_state[st_map[tr.src], sym_map[tr.symbol]] = st_map[tr.dest]
+            log_weight[st_map[tr.src], sym_map[tr.symbol]] = math.log(tr.weight)
+
+        log_final = numpy.full((len(states),), -numpy.inf, dtype=numpy.float64)
+        for st, weight in aut.get_finals().items():
+            if weight > 0.0 and st in st_map:
+                log_final[st_map[st]] = math.log(weight)
+
+        log_start = math.log(start_weight) if start_weight > 0.0 else -numpy.inf
+        return CompiledDPA(symbols, next_state, log_weight, log_final, 0, log_start)
+
+
+    def to_wfa(self):
+        """!
+        Convert the compiled PA back to a WFA. States are numbered from 0 to
+        n-1 (missing transitions and zero final weights are omitted). The
+        compiled form of the WFA is this PA.
+
+        @return Deterministic PA (core_wfa.CoreWFA)
+        """
+        import wfa.core_wfa as core_wfa
+
+        src, sym = numpy.nonzero(self.next_state != NO_STATE)
+        dest = self.next_state[src, sym]
+        weights = numpy.exp(numpy.asarray(self.log_weight[src, sym], dtype=numpy.float64))
+        transitions = [core_wfa.Transition(s, d, self.symbols[a], w) for s, d, a, w in \
+            zip(src.tolist(), dest.tolist(), sym.tolist(), weights.tolist())]
+        fin = numpy.nonzero(self.log_final != -numpy.inf)[0]
+        finals = dict(zip(fin.tolist(), numpy.exp(numpy.asarray(self.log_final[fin], dtype=numpy.float64)).tolist()))
+        start = {int(self.start): math.exp(self.log_start) if self.log_start != -numpy.inf else 0.0}
+        aut = core_wfa.CoreWFA(transitions, finals, start, list(self.symbols))
+        aut._compiled = self
+        return aut
+
+
+    def cursor(self) -> "DPACursor":
+        """!
+        Get a cursor placed in the initial state.
+
+        @return Cursor for reading a word symbol by symbol
+        """
+        return DPACursor(self)
+
+
+    def num_states(self) -> int:
+        """!
+        Get the number of states
+
+        @return Number of states
+        """
+        return self.next_state.shape[0]
+
+
+    def encode(self, word: Sequence[Any]) -> numpy.ndarray:
+        """!
+        Encode a word to a sequence of symbol codes.
+
+        @param word: Word (sequence of symbols)
+
+        @return Array of symbol codes (NO_SYMBOL for unknown symbols)
+        """
+        return numpy.fromiter((self.sym_map.get(sym, NO_SYMBOL) for sym in word), dtype=numpy.int32, count=len(word))
+
+
+    def score(self, word: Sequence[Any]) -> Optional[float]:
+        """!
+        Compute the log-probability of a word.
+
+        @param word: Word
+
+        @return Log-probability of word (None if the word is not accepted)
+        """
+        act = self.start
+        prob = self.log_start
+        for sym in word:
+            code = self.sym_map.get(sym, NO_SYMBOL)
+            if code == NO_SYMBOL or self.next_state[act, code] == NO_STATE:
+                return None
+            prob += self.log_weight[act, code]
+            act = self.next_state[act, code]
+        prob += self.log_final[act]
+        if prob == -numpy.inf:
+            return None
+        return float(prob)
+
+
+    def score_array(self, words: Sequence[Sequence[Any]]) -> numpy.ndarray:
+        """!
+        Compute log-probabilities of a batch of words. All words are processed
+        at once, symbol by symbol.
+
+        @param words: List of words
+
+        @return Array of log-probabilities (-inf for words that are not accepted)
+        """
+        cnt = len(words)
+        if cnt == 0:
+            return numpy.empty((0,), dtype=numpy.float64)
+        lens = numpy.fromiter((len(w) for w in words), dtype=numpy.int64, count=cnt)
+        codes = numpy.full((cnt, int(lens.max())), NO_SYMBOL, dtype=numpy.int32)
+        for i, word in enumerate(words):
+            codes[i, :lens[i]] = self.encode(word)
+
+        act = numpy.full((cnt,), self.start, dtype=numpy.int32)
+        prob = numpy.full((cnt,), self.log_start, dtype=numpy.float64)
+        alive = numpy.full((cnt,), self.log_start != -numpy.inf)
+        for i in range(codes.shape[1]):
+            ind = numpy.nonzero(alive & (lens > i))[0]
+            sym = codes[ind, i]
+            known = sym != NO_SYMBOL
+            nxt = numpy.full(ind.shape, NO_STATE, dtype=numpy.int32)
+            nxt[known] = self.next_state[act[ind[known]], sym[known]]
+            dead = nxt == NO_STATE
+            alive[ind[dead]] = False
+            ind, sym, nxt = ind[~dead], sym[~dead], nxt[~dead]
+            prob[ind] += self.log_weight[act[ind], sym]
+            act[ind] = nxt
+
+        prob += self.log_final[act]
+        prob[~alive] = -numpy.inf
+        return prob
+
+
+    def score_many(self, words: Sequence[Sequence[Any]]) -> List[Optional[float]]:
+        """!
+        Compute log-probabilities of a batch of words.
+
+        @param words: List of words
+
+        @return List of log-probabilities (None for words that are not accepted)
+        """
+        return [None if p == -numpy.inf else float(p) for p in self.score_array(words)]
+
+
+    def accepted_many(self, words: Sequence[Sequence[Any]]) -> numpy.ndarray:
+        """!
+        Check which words from the batch are accepted (have a nonzero
+        probability).
+
+        @param words: List of words
+
+        @return Boolean array (True -- the word is accepted)
+        """
+        return self.score_array(words) != -numpy.inf
+
+
+    def _get_cumulative(self) -> numpy.ndarray:
+        """!
+        Get the table of cumulative weights used for sampling. Column 0
+        corresponds to the final weight, column i+1 to symbol i. Each row is
+        normalized to sum to one (rows of states without any continuation
+        end the word).
+
+        @return Table of cumulative weights (states x (symbols + 1))
+        """
+        if self._cumulative is None:
+            weights = numpy.exp(numpy.hstack((self.log_final[:, None], self.log_weight)))
+            weights[numpy.hstack((numpy.zeros((self.num_states(), 1), dtype=bool), self.next_state == NO_STATE))] = 0.0
+            cum = numpy.cumsum(weights, axis=1)
+            total = cum[:, -1:].copy()
+            dead = total[:, 0] == 0.0
+            total[dead] = 1.0
+            cum = cum / total
+            #Words reaching a state without any continuation are ended
+            cum[dead] = 1.0
+            self._cumulative = cum
+        return self._cumulative
+
+
+    def sample_codes(self, n: int, rng: Optional[numpy.random.Generator]=None, max_length: int=1000) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """!
+        Draw n words (encoded as symbol codes) from the distribution given by
+        the PA. All words are generated at once, symbol by symbol; in each
+        step, the next symbol (or the end of the word) of all unfinished words
+        is drawn from the cumulative weight table. Words are truncated at
+        max_length symbols.
+
+        @param n: Number of words
+        @param rng: Random number generator (numpy.random.Generator)
+        @param max_length: Maximum length of a word
+
+        @return Pair (matrix of symbol codes (n x max. length, padded by
+            NO_SYMBOL), lengths of words)
+        """
+        if rng is None:
+            rng = numpy.random.default_rng()
+        cum = self._get_cumulative()
+        act = numpy.full((n,), self.start, dtype=numpy.int32)
+        lens = numpy.zeros((n,), dtype=numpy.int64)
+        ind = numpy.arange(n)
+        steps = []
+        while len(ind) > 0 and len(steps) < max_length:
+            u = rng.random(len(ind))
+            choice = (cum[act[ind]] <= u[:, None]).sum(axis=1)
+            choice = numpy.minimum(choice, cum.shape[1] - 1)
+            step = numpy.full((n,), NO_SYMBOL, dtype=numpy.int32)
+            cont = choice > 0
+            ind, sym = ind[cont], choice[cont] - 1
+            step[ind] = sym
+            steps.append(step)
+            act[ind] = self.next_state[act[ind], sym]
+            lens[ind] += 1
+
+        codes = numpy.vstack(steps).T if steps else numpy.zeros((n, 0), dtype=numpy.int32)
+        return codes, lens
+
+
+    def sample(self, n: int, rng: Optional[numpy.random.Generator]=None, max_length: int=1000) -> List[Tuple[Any, ...]]:
+        """!
+        Draw n words from the distribution given by the PA.
+
+        @param n: Number of words
+        @param rng: Random number generator (numpy.random.Generator)
+        @param max_length: Maximum length of a word (longer words are truncated)
+
+        @return List of words (tuples of symbols)
+        """
+        codes, lens = self.sample_codes(n, rng, max_length)
+        return [tuple(self.symbols[c] for c in row[:ln]) for row, ln in zip(codes.tolist(), lens.tolist())]
+
+
+class DPACursor:
+    """!
+    Cursor reading a word symbol by symbol in a compiled PA. Keeps the current
+    state and the cumulative log-probability of the prefix read so far.
+    """
+
+    def __init__(self, dpa: CompiledDPA):
+        """!
+        Constructor
+
+        @param dpa: Compiled PA
+        """
+        self.dpa = dpa
+        ## Current state (NO_STATE if the prefix is not in the support)
+        self.state = dpa.start if dpa.log_start != -numpy.inf else NO_STATE
+        ## Log-probability of the prefix read so far (without the final weight)
+        self.log_prob = dpa.log_start
+        ## Number of symbols read so far
+        self.length = 0
+
+
+    def is_dead(self) -> bool:
+        """!
+        Is the prefix read so far out of the support of the PA (i.e., no
+        extension of the prefix is accepted)?
+
+        @return True -- dead end
+        """
+        return self.state == NO_STATE
+
+
+    def advance(self, symbol: Any) -> bool:
+        """!
+        Read a symbol.
+
+        @param symbol: Symbol
+
+        @return False if the cursor got to a dead end (by this or some previous symbol)
+        """
+        self.length += 1
+        if self.state == NO_STATE:
+            return False
+        code = self.dpa.sym_map.get(symbol, NO_SYMBOL)
+        nxt = NO_STATE if code == NO_SYMBOL else int(self.dpa.next_state[self.state, code])
+        if nxt == NO_STATE:
+            self.state = NO_STATE
+            self.log_prob = -numpy.inf
+            return False
+        self.log_prob += float(self.dpa.log_weight[self.state, code])
+        self.state = nxt
+        return True
+
+
+    def final_log_prob(self) -> Optional[float]:
+        """!
+        Get the log-probability of the word read so far (including the final
+        weight).
+
+        @return Log-probability (None if the word is not accepted)
+        """
+        if self.state == NO_STATE or self.dpa.log_final[self.state] == -numpy.inf:
+            return None
+        return float(self.log_prob + self.dpa.log_final[self.state])
+
+
+    def is_accepting(self) -> bool:
+        """!
+        Is the word read so far accepted?
+
+        @return True -- accepted
+        """
+        return self.final_log_prob() is not None
@@ -26,11 +26,14 @@
 
 import copy
 import bidict
+import heapq
 import math
 import wfa.wfa_exceptions as wfa_exceptions
+import algorithms.reachability as reachability
 
-from typing import List, Optional, Set, TypeVar, Generic, Callable
+from typing import List, Optional, Set, TypeVar, Generic, Callable, Tuple
 from collections import deque, defaultdict
+from enum import Enum
 
 StateType = TypeVar("StateType")
 SymbolType = TypeVar("SymbolType")
@@ -38,11 +41,26 @@ StateFloatMapType = dict[StateType, float]
 StateFloatMapOptType = Optional[dict[StateType, float]]
 TransFunctionType = dict[StateType, dict[SymbolType, Set[StateType]]]
 
+class StateOrder(Enum):
+    """!
+    Orders of states used for numbering states by rename_states.
+    """
+
+    ## Start states first, then in the order of get_states
+    default = 1
+    ## BFS order from the start states
+    bfs = 2
+    ## Reverse Cuthill-McKee order (reduces the fill-in of sparse LU)
+    rcm = 3
+
+
 class Transition(Generic[StateType, SymbolType]):
     """!
     Class for the represention of a WFA transition.
     """
 
+    __slots__ = ("src", "dest", "symbol", "weight")
+
     def __init__(self, src: StateType, dest: StateType, sym: SymbolType, weight: float):
         """!
         Constructor
@@ -56,7 +74,6 @@ class Transition(Generic[StateType, SymbolType]):
         self.dest = dest
         self.symbol = sym
         self.weight = weight
-        self.count = 0
 
 
     def __str__(self) -> str:
@@ -110,6 +127,14 @@ class Transition(Generic[StateType, SymbolType]):
         return hash((self.src, self.dest, self.symbol, self.weight))
 
 
+class _DifferenceSink:
+    """!
+    Implicit sink state of a complemented automaton (used by the on-the-fly
+    difference).
+    """
+    pass
+
+
 class CoreWFA(Generic[StateType, SymbolType]):
     """!
     Basic class for representation of WFA
@@ -142,6 +167,7 @@ class CoreWFA(Generic[StateType, SymbolType]):
         # else:
         self._start = start
         self._states_dict = None
+        self._invalidate_cache()
 
         self._alphabet: List[SymbolType] = []
         if alphabet is None:
@@ -176,6 +202,50 @@ class CoreWFA(Generic[StateType, SymbolType]):
         return hash((tuple(self._transitions), tuple(self._finals), tuple(self._start), tuple(self._alphabet)))
 
 
+    def _invalidate_cache(self) -> None:
+        """!
+        Drop cached transition indices. Has to be called by each method
+        modifying the transitions (or the initial states) of the WFA.
+        """
+        self._symbol_index: Optional[TransFunctionType] = None
+        self._succ_index: Optional[dict[StateType, List[Transition]]] = None
+        self._pred_index: Optional[dict[StateType, List[Transition]]] = None
+        self._alphabet_cache: Optional[List[SymbolType]] = None
+        self._deterministic: Optional[bool] = None
+        self._compiled = None
+        self._canonical: dict[float, tuple] = dict()
+        self._operators: dict[bool, tuple] = dict()
+        self._distribution: Optional[Tuple[Optional[dict], ...]] = None
+
+
+    def _build_index(self) -> None:
+        """!
+        Build the forward (State -> Symbol -> Set of transitions, State ->
+        List of transitions) and the reverse (State -> List of transitions)
+        transition indices in a single pass over the transitions.
+        """
+        symbol_index: TransFunctionType = dict()
+        succ_index: dict[StateType, List[Transition]] = dict()
+        pred_index: dict[StateType, List[Transition]] = dict()
+
+        for st in self.get_states():
+            symbol_index[st] = dict()
+            succ_index[st] = []
+            pred_index[st] = []
+
+        for transition in self._transitions:
+            succ_index[transition.src].append(transition)
+            pred_index[transition.dest].append(transition)
+            try:
+                symbol_index[transition.src][transition.symbol].add(transition)
+            except KeyError:
+                symbol_index[transition.src][transition.symbol] = set([transition])
+
+        self._symbol_index = symbol_index
+        self._succ_index = succ_index
+        self._pred_index = pred_index
+
+
     def get_transitions(self) -> List[Transition]:
         """!
         Get all transitions of the WFA.
@@ -192,6 +262,10 @@ class CoreWFA(Generic[StateType, SymbolType]):
         self._finals = dict()
         for st in self.get_states():
             self._finals[st] = 1.0
+        self._compiled = None
+        self._canonical = dict()
+        self._operators = dict()
+        self._distribution = None
 
 
     def get_finals(self) -> StateFloatMapType:
@@ -210,6 +284,10 @@ class CoreWFA(Generic[StateType, SymbolType]):
         @param finals: Dictionary of final states and their weight of accepting.
         """
         self._finals = finals
+        self._compiled = None
+        self._canonical = dict()
+        self._operators = dict()
+        self._distribution = None
 
 
     def get_starts(self) -> StateFloatMapType:
@@ -228,6 +306,11 @@ class CoreWFA(Generic[StateType, SymbolType]):
         @param start: New initial state
         """
         self._start = start
+        self._deterministic = None
+        self._compiled = None
+        self._canonical = dict()
+        self._operators = dict()
+        self._distribution = None
 
 
     def set_alphabet(self, alph: List[SymbolType]) -> None:
@@ -237,6 +320,7 @@ class CoreWFA(Generic[StateType, SymbolType]):
         @param alph: New alphabet
         """
         self._alphabet = alph
+        self._alphabet_cache = None
 
 
     def get_alphabet(self) -> List[SymbolType]:
@@ -246,13 +330,12 @@ class CoreWFA(Generic[StateType, SymbolType]):
 
         @return List of symbols.
         """
-        alph: List[SymbolType] = []
         if self._alphabet != None and len(self._alphabet) > 0:
             return self._alphabet
-        for transition in self._transitions:
-            if transition.symbol not in alph:
-                alph.append(transition.symbol)
-        return alph
+        if self._alphabet_cache is None:
+            self._alphabet_cache = list(dict.fromkeys(transition.symbol \
+                for transition in self._transitions))
+        return self._alphabet_cache
 
 
     def rename_alphabet(self, dct):
@@ -266,6 +349,7 @@ class CoreWFA(Generic[StateType, SymbolType]):
 
         self._transitions = list(map (lambda x: Transition(x.src, x.dest, \
             dct.inverse[x.symbol], x.weight), self._transitions))
+        self._invalidate_cache()
 
 
     def _get_states(self) -> List[StateType]:
@@ -340,17 +424,12 @@ class CoreWFA(Generic[StateType, SymbolType]):
         Get transitions in the form of dictionary (for each state there is a
         list of transitions leading from this state).
 
-        @return Dictionary assigning State -> List(Transitions)
+        @return Dictionary assigning State -> List(Transitions) (cached, must
+            not be modified)
         """
-        tr_dict: dict[StateType, List[Transition]] = dict()
-
-        states = self.get_states()
-        for st in states:
-            tr_dict[st] = []
-
-        for transition in self._transitions:
-            tr_dict[transition.src].append(transition)
-        return tr_dict
+        if self._succ_index is None:
+            self._build_index()
+        return self._succ_index
 
 
     def get_state_symbol_dict(self) -> TransFunctionType:
@@ -358,20 +437,12 @@ class CoreWFA(Generic[StateType, SymbolType]):
         Get transitions in the form of dictionary (for each state there is a
         dictionary assigning to symbols a set of transitions)
 
-        @return Dictionary assigning State -> (Dictionary: Symbol -> Set of transitions)
+        @return Dictionary assigning State -> (Dictionary: Symbol -> Set of
+            transitions) (cached, must not be modified)
         """
-        tr_dict: TransFunctionType = dict()
-
-        states = self.get_states()
-        for st in states:
-            tr_dict[st] = dict()
-
-        for transition in self._transitions:
-            try:
-                tr_dict[transition.src][transition.symbol].add(transition)
-            except KeyError:
-                tr_dict[transition.src][transition.symbol] = set([transition])
-        return tr_dict
+        if self._symbol_index is None:
+            self._build_index()
+        return self._symbol_index
 
 
     def get_rev_transitions_aut(self) -> "CoreWFA":
@@ -388,27 +459,39 @@ class CoreWFA(Generic[StateType, SymbolType]):
         return CoreWFA(rev_transitions, copy.copy(self._finals), copy.copy(self._start), copy.copy(self.get_alphabet()))
 
 
-    def rename_states(self):
+    def get_state_order(self, order: StateOrder) -> List[StateType]:
+        """!
+        Get all states of the WFA in a given order.
+
+        @param order: Order of states (StateOrder)
+
+        @return List of states
+        """
+        if order == StateOrder.default:
+            return list(dict.fromkeys(list(self._start.keys()) + self.get_states()))
+        states, index, reach = self.get_reachability()
+        if order == StateOrder.bfs:
+            perm = reach.breadth_first_order(index[st] for st in self._start.keys())
+        else:
+            perm = reach.reverse_cuthill_mckee()
+        return [states[i] for i in perm]
+
+
+    def rename_states(self, order: StateOrder=StateOrder.default):
         """!
         Rename states of the WFA. Assign to the states numbers from 0 to n-1 (n
-        is the number of states). The start state has number 0. The renamed and
-        original states are stored in the states_dict dictionary.
+        is the number of states). The start state has number 0 (except for
+        the reverse Cuthill-McKee order). The renamed and original states are
+        stored in the states_dict dictionary.
+
+        @param order: Order of states used for the numbering (StateOrder). The
+            BFS or reverse Cuthill-McKee order reduce the bandwidth of the
+            transition matrix (and hence the fill-in of its sparse LU).
         """
-        self._states_dict = dict()
+        self._states_dict = dict((st, i) for i, st in enumerate(self.get_state_order(order)))
         new_transitions = []
         new_finals = dict()
-        new_starts = dict()
-        count = 0
-
-        for st, weight in self._start.items():
-            self._states_dict[st] = count
-            new_starts[count] = weight
-            count += 1
-
-        for state in self.get_states():
-            if state not in self._states_dict:
-                self._states_dict[state] = count
-                count += 1
+        new_starts = dict((self._states_dict[st], weight) for st, weight in self._start.items())
 
         for (state, prob) in self._finals.items():
             dest = self._states_dict[state]
@@ -424,57 +507,121 @@ class CoreWFA(Generic[StateType, SymbolType]):
         self._finals = new_finals
         self._start = new_starts
         self._states = self._get_states()
+        self._invalidate_cache()
 
 
-    def product(self, aut: "CoreWFA") -> "CoreWFA":
+    def product(self, aut: "CoreWFA", trim: bool=False, rename: bool=False, order: StateOrder=StateOrder.bfs) -> "CoreWFA":
         """!
-        Perform the product of two WFAs.
+        Perform the product of two WFAs. Pairs of states are explored in the
+        BFS order (each pair is explored once) and outgoing transitions are
+        joined on symbols.
 
         @param aut: Second automaton for the product.
+        @param trim: Return the trimmed product (equivalent to
+            product(aut).get_trim_automaton()).
+        @param rename: Label the states of the product by numbers 0 to n-1 in
+            the BFS order (the start state has number 0). The original pairs of
+            states are stored in the states_dict dictionary.
+        @param order: Order of renamed states (StateOrder.bfs or
+            StateOrder.rcm)
 
         @return WFA representing the product of WFAs
         """
-        #queue = deque([])
-        queue = []
-        ret_finals = dict()
-        ret_start = dict()
-        ret_transitions = []
-
-        self_finals = set(self._finals.keys())
-        aut_finals = set(aut.get_finals().keys())
+        pairs: List[tuple] = []
+        pair_ids: dict[tuple, int] = dict()
+        start_weights: List[float] = []
 
         for st1, weight1 in self._start.items():
             for st2, weight2 in aut.get_starts().items():
-                queue.append((st1, st2))
-                ret_start[(st1, st2)] = weight1 * weight2
-
-        finished = set([])
-        tr_dict1 = self.get_dictionary_transitions()
-        tr_dict2 = aut.get_dictionary_transitions()
-
-        while len(queue) > 0:
-            act = queue.pop(0)
-            finished.add(act)
-
-            if (act[0] in self_finals) \
-                and (act[1] in aut_finals):
-                ret_finals[act] = self._finals[act[0]] \
-                    * aut.get_finals()[act[1]]
-
-            for tr1 in tr_dict1[act[0]]:
-                for tr2 in tr_dict2[act[1]]:
-                    if tr2.symbol != tr1.symbol:
-                        continue
-
-                    dest_state = (tr1.dest, tr2.dest)
-                    ret_transitions.append(Transition(act, dest_state, \
-                        tr1.symbol, tr1.weight * tr2.weight))
+                if (st1, st2) not in pair_ids:
+                    pair_ids[(st1, st2)] = len(pairs)
+                    pairs.append((st1, st2))
+                    start_weights.append(weight1 * weight2)
+
+        tr_dict1 = self.get_state_symbol_dict()
+        tr_dict2 = aut.get_state_symbol_dict()
+        aut_finals = aut.get_finals()
+        prod_transitions: List[tuple] = []
+        prod_finals: dict[int, float] = dict()
+        pred: List[List[int]] = []
+
+        act = 0
+        while act < len(pairs):
+            st1, st2 = pairs[act]
+            pred.append([])
+            if (st1 in self._finals) and (st2 in aut_finals):
+                prod_finals[act] = self._finals[st1] * aut_finals[st2]
+
+            sym_dict2 = tr_dict2[st2]
+            for sym, trs1 in tr_dict1[st1].items():
+                trs2 = sym_dict2.get(sym)
+                if trs2 is None:
+                    continue
+                for tr1 in trs1:
+                    for tr2 in trs2:
+                        dest_state = (tr1.dest, tr2.dest)
+                        dest = pair_ids.get(dest_state)
+                        if dest is None:
+                            dest = len(pairs)
+                            pair_ids[dest_state] = dest
+                            pairs.append(dest_state)
+                        prod_transitions.append((act, dest, sym, tr1.weight * tr2.weight))
+            act += 1
+
+        keep = None
+        if trim:
+            for src, dest, _, _ in prod_transitions:
+                pred[dest].append(src)
+            keep = [False] * len(pairs)
+            queue = deque([])
+            for st in prod_finals.keys():
+                keep[st] = True
+                queue.append(st)
+            while queue:
+                head = queue.popleft()
+                for src in pred[head]:
+                    if not keep[src]:
+                        keep[src] = True
+                        queue.append(src)
+            #The restriction keeps a single initial state if no initial state
+            #is coaccessible (see get_automata_restriction).
+            if len(pairs) > 0 and not any(keep[:len(start_weights)]):
+                keep[0] = True
+
+        if rename:
+            labels: List = [None] * len(pairs)
+            count = 0
+            for i in range(len(pairs)):
+                if keep is None or keep[i]:
+                    labels[i] = count
+                    count += 1
+        else:
+            labels = pairs
 
-                    if (dest_state not in finished): #and (dest_state not in queue):
-                        queue.append(dest_state)
+        ret_start = dict()
+        for i, weight in enumerate(start_weights):
+            if keep is None or keep[i]:
+                ret_start[labels[i]] = weight
+        ret_finals = dict()
+        for st, weight in prod_finals.items():
+            if keep is None or keep[st]:
+                ret_finals[labels[st]] = weight
+        ret_transitions = []
+        for src, dest, sym, weight in prod_transitions:
+            if keep is None or (keep[src] and keep[dest]):
+                ret_transitions.append(Transition(labels[src], labels[dest], sym, weight))
 
         alphabet = set(self.get_alphabet()) & set(aut.get_alphabet())
-        return CoreWFA(ret_transitions, ret_finals, ret_start, list(alphabet))
+        ret = CoreWFA(ret_transitions, ret_finals, ret_start, list(alphabet))
+        if rename:
+            ret._states_dict = dict((pairs[i], labels[i]) for i in range(len(pairs)) \
+                if labels[i] is not None)
+            if order == StateOrder.rcm:
+                pair_dict = ret._states_dict
+                ret.rename_states(order)
+                ret._states_dict = dict((pair, ret._states_dict[lab]) \
+                    for pair, lab in pair_dict.items())
+        return ret
 
 
     def breadth_first_search(self, state: StateType, visited: Set[StateType], tr_dict: dict[StateType, List[Transition]]):
@@ -488,29 +635,46 @@ class CoreWFA(Generic[StateType, SymbolType]):
         @return Out parameter visited (the list of visited states).
         """
         queue = deque([state])
+        visited.add(state)
         if tr_dict is None:
             tr_dict = self.get_single_dictionary_transitions()
         while queue:
             head = queue.popleft()
-            visited.add(head)
             for transition in tr_dict[head]:
-                if (transition.dest not in visited) \
-                    and (transition.dest not in queue):
+                if transition.dest not in visited:
+                    visited.add(transition.dest)
                     queue.append(transition.dest)
 
 
+    def get_reachability(self) -> Tuple[List[StateType], dict[StateType, int], reachability.Reachability]:
+        """!
+        Get the integer-indexed transition graph of the WFA used for a
+        reachability analysis.
+
+        @return Triple (list of states, State -> index, reachability graph)
+        """
+        states = self.get_states()
+        index = dict((st, i) for i, st in enumerate(states))
+        reach = reachability.Reachability(len(states), \
+            ((index[tr.src], index[tr.dest]) for tr in self._transitions))
+        return states, index, reach
+
+
     def get_coaccessible_states(self, tr_dict: Optional[dict[StateType, List[Transition]]]=None) -> Set[StateType]:
         """!
         Get coaccessible states of the WFA.
 
-        @param tr_dict: Transition dictionary.
+        @param tr_dict: Transition dictionary (of the reversed WFA).
 
         @return The list of coaccessible states.
         """
         visited: Set[StateType] = set([])
-        reverse_aut = self.get_rev_transitions_aut()
         if tr_dict is None:
-            tr_dict = reverse_aut.get_single_dictionary_transitions()
+            states, index, reach = self.get_reachability()
+            marks = reach.backward(index[st] for st in self._finals.keys() if st in index)
+            return set(st for st, m in zip(states, marks) if m)
+
+        reverse_aut = self.get_rev_transitions_aut()
         for state, _ in reverse_aut.get_finals().items():
             reverse_aut.breadth_first_search(state, visited, tr_dict)
         return visited
@@ -526,7 +690,10 @@ class CoreWFA(Generic[StateType, SymbolType]):
         """
         visited: Set[StateType] = set([])
         if tr_dict is None:
-            tr_dict = self.get_single_dictionary_transitions()
+            states, index, reach = self.get_reachability()
+            marks = reach.forward(index[st] for st in self._start.keys() if st in index)
+            return set(st for st, m in zip(states, marks) if m)
+
         for state, _ in self.get_starts().items():
             self.breadth_first_search(state, visited, tr_dict)
         return visited
@@ -573,8 +740,10 @@ class CoreWFA(Generic[StateType, SymbolType]):
 
         @return Trimmed WFA.
         """
-        sts = self.get_coaccessible_states() & self.get_accessible_states()
-        return self.get_automata_restriction(sts)
+        states, index, reach = self.get_reachability()
+        marks = reach.useful((index[st] for st in self._start.keys() if st in index), \
+            (index[st] for st in self._finals.keys() if st in index))
+        return self.get_automata_restriction(set(st for st, m in zip(states, marks) if m))
 
 
     def get_predecessors(self, state: StateType) -> Set[StateType]:
@@ -585,28 +754,18 @@ class CoreWFA(Generic[StateType, SymbolType]):
 
         @return List of predecessors
         """
-        ret = set([])
-        transitions = self.get_transitions()
-        for tr in transitions:
-            if tr.dest == state:
-                ret.add(tr.src)
-        return ret
+        return set([tr.src for tr in self.get_predecessors_transitions().get(state, [])])
 
 
     def get_predecessors_transitions(self) -> dict[StateType, List[Transition]]:
         """!
         Get predecessors of all states of the WFA.
 
-        @return Dict: State -> List(State)
+        @return Dict: State -> List(Transition) (cached, must not be modified)
         """
-        predecessors: dict[StateType, List[Transition]] = {}
-        for state in self.get_states():
-            predecessors[state] = []
-
-        for transition in self.get_transitions():
-            predecessors[transition.dest].append(transition)
-
-        return predecessors
+        if self._pred_index is None:
+            self._build_index()
+        return self._pred_index
 
 
     def is_deterministic(self) -> bool:
@@ -615,14 +774,11 @@ class CoreWFA(Generic[StateType, SymbolType]):
 
         @return True deterministic, otherwise False
         """
-        if len(self._start) > 1:
-            return False
-        tr_dict = self.get_state_symbol_dict()
-        for st, sym_dict in tr_dict.items():
-            for symbol, trs in sym_dict.items():
-                if len(trs) > 1:
-                    return False
-        return True
+        if self._deterministic is None:
+            self._deterministic = len(self._start) <= 1 and \
+                all(len(trs) <= 1 for sym_dict in self.get_state_symbol_dict().values() \
+                    for trs in sym_dict.values())
+        return self._deterministic
 
 
     def string_prob_deterministic(self, word: List[SymbolType]) -> Optional[float]:
@@ -650,6 +806,288 @@ class CoreWFA(Generic[StateType, SymbolType]):
         return prob
 
 
+    @staticmethod
+    def _sorted_symbols(symbols) -> List[SymbolType]:
+        """!
+        Sort symbols (symbols of incomparable types are sorted according to
+        their string representation).
+
+        @param symbols: Collection of symbols
+
+        @return Sorted list of symbols
+        """
+        try:
+            return sorted(symbols)
+        except TypeError:
+            return sorted(symbols, key=repr)
+
+
+    def get_canonical_order(self) -> List[StateType]:
+        """!
+        Get the canonical order of states of the DPA: states reachable from the
+        initial state in the BFS order, where successors are visited in the
+        order of symbols.
+
+        @return List of reachable states in the canonical order
+        """
+        if not self.is_deterministic():
+            raise wfa_exceptions.WFAOperationException("Canonical form is defined only for deterministic WFAs.")
+
+        tr_dict = self.get_state_symbol_dict()
+        order = list(self._start.keys())
+        index = set(order)
+        i = 0
+        while i < len(order):
+            sym_dict = tr_dict.get(order[i], dict())
+            for sym in CoreWFA._sorted_symbols(sym_dict.keys()):
+                dest = next(iter(sym_dict[sym])).dest
+                if dest not in index:
+                    index.add(dest)
+                    order.append(dest)
+            i += 1
+        return order
+
+
+    def get_canonical_key(self, tolerance: float=0.0) -> tuple:
+        """!
+        Get the canonical key of the DPA. Two DPAs have the same key iff they
+        are isomorphic (on the reachable part) with equal weights. If
+        tolerance is nonzero, weights are first quantized to multiples of
+        tolerance (close weights falling to different multiples are still
+        distinguished). The key is cached until the WFA is modified.
+
+        @param tolerance: Weight tolerance
+
+        @return Canonical key (tuple)
+        """
+        if tolerance in self._canonical:
+            return self._canonical[tolerance]
+
+        quant: Callable[[float], float] = (lambda w: w) if tolerance == 0.0 \
+            else (lambda w: round(w / tolerance))
+        order = self.get_canonical_order()
+        index = dict((st, i) for i, st in enumerate(order))
+        tr_dict = self.get_state_symbol_dict()
+
+        key: List[tuple] = []
+        for st in order:
+            sym_dict = tr_dict.get(st, dict())
+            trs = []
+            for sym in CoreWFA._sorted_symbols(sym_dict.keys()):
+                tr = next(iter(sym_dict[sym]))
+                trs.append((sym, index[tr.dest], quant(tr.weight)))
+            key.append((quant(self._start.get(st, 0.0)), quant(self._finals.get(st, 0.0)), tuple(trs)))
+        self._canonical[tolerance] = tuple(key)
+        return self._canonical[tolerance]
+
+
+    def get_fingerprint(self, tolerance: float=0.0) -> int:
+        """!
+        Get the structural fingerprint (hash of the canonical key) of the DPA.
+
+        @param tolerance: Weight tolerance
+
+        @return Fingerprint
+        """
+        return hash(self.get_canonical_key(tolerance))
+
+
+    def get_canonical_form(self) -> "CoreWFA":
+        """!
+        Get the canonical form of the DPA: the reachable part with states
+        renamed to 0 to n-1 in the canonical order and transitions sorted by
+        the source state and symbol.
+
+        @return DPA in the canonical form
+        """
+        order = self.get_canonical_order()
+        index = dict((st, i) for i, st in enumerate(order))
+        tr_dict = self.get_state_symbol_dict()
+
+        transitions = []
+        for st in order:
+            sym_dict = tr_dict.get(st, dict())
+            for sym in CoreWFA._sorted_symbols(sym_dict.keys()):
+                tr = next(iter(sym_dict[sym]))
+                transitions.append(Transition(index[st], index[tr.dest], sym, tr.weight))
+        finals = dict((index[st], w) for st, w in self._finals.items() if st in index and w != 0.0)
+        starts = dict((index[st], w) for st, w in self._start.items())
+        return CoreWFA(transitions, finals, starts, CoreWFA._sorted_symbols(self.get_alphabet()))
+
+
+    def minimize(self, tolerance: float=0.0) -> "CoreWFA":
+        """!
+        Minimize the DPA by partition refinement. States are first split
+        according to their final weights and outgoing symbols with weights,
+        then blocks are refined according to blocks of successors until the
+        partition is stable. Only states reachable from the initial state are
+        kept. If tolerance is nonzero, weights are compared after quantization
+        to multiples of tolerance and weights of a merged state are averaged.
+
+        @param tolerance: Weight tolerance
+
+        @return Minimal DPA (states are numbered from 0, the initial state has number 0)
+        """
+        quant: Callable[[float], float] = (lambda w: w) if tolerance == 0.0 \
+            else (lambda w: round(w / tolerance))
+        order = self.get_canonical_order()
+        tr_dict = self.get_state_symbol_dict()
+        succ: dict[StateType, List[Tuple[SymbolType, Transition]]] = dict()
+        for st in order:
+            sym_dict = tr_dict.get(st, dict())
+            succ[st] = [(sym, next(iter(sym_dict[sym]))) for sym in CoreWFA._sorted_symbols(sym_dict.keys())]
+
+        signature = dict((st, (quant(self._finals.get(st, 0.0)), \
+            tuple((sym, quant(tr.weight)) for sym, tr in succ[st]))) for st in order)
+        block: dict[StateType, int] = dict()
+        count = 0
+        while True:
+            ids: dict[tuple, int] = dict()
+            for st in order:
+                block[st] = ids.setdefault(signature[st], len(ids))
+            if len(ids) == count:
+                break
+            count = len(ids)
+            signature = dict((st, (block[st], tuple((sym, block[tr.dest]) \
+                for sym, tr in succ[st]))) for st in order)
+
+        members: List[List[StateType]] = [[] for _ in range(count)]
+        for st in order:
+            members[block[st]].append(st)
+
+        transitions = []
+        finals = dict()
+        for i, states in enumerate(members):
+            for j, (sym, tr) in enumerate(succ[states[0]]):
+                weight = sum(succ[st][j][1].weight for st in states) / len(states)
+                transitions.append(Transition(i, block[tr.dest], sym, weight))
+            fin = sum(self._finals.get(st, 0.0) for st in states) / len(states)
+            if fin != 0.0:
+                finals[i] = fin
+        starts = dict((block[st], weight) for st, weight in self._start.items())
+        return type(self)(transitions, finals, starts, copy.copy(self.get_alphabet()))
+
+
+    def prune(self, epsilon: float) -> Tuple["CoreWFA", float]:
+        """!
+        Remove transitions and final weights of the PA lower than epsilon
+        (the largest one of each state is always kept) and renormalize
+        weights of each state. Assuming the PA represents a probability
+        distribution P, the pruned PA represents Q such that Q(w) >= P'(w) for
+        each w, where P' is P restricted to words not using removed items. If
+        m is the probability of words using removed items, then
+        ||P - Q||_2 <= ||P - Q||_1 <= m + (1 - (1 - m)) = 2m.
+
+        @param epsilon: Pruning threshold
+
+        @return Pair (pruned PA, upper bound of the L2 distance of the pruned and the original PA)
+        """
+        import wfa.matrix_wfa as matrix_wfa
+
+        tr_dict = self.get_dictionary_transitions()
+        transitions = []
+        finals = dict()
+        kept_transitions = []
+        kept_finals = dict()
+        for st in self.get_states():
+            items = [(tr.weight, tr) for tr in tr_dict.get(st, [])]
+            if st in self._finals:
+                items.append((self._finals[st], None))
+            if len(items) == 0:
+                continue
+            best = max(items, key=lambda x: x[0])[1]
+            kept = [(w, tr) for w, tr in items if w >= epsilon or tr is best]
+            total = sum(w for w, _ in kept)
+            for w, tr in kept:
+                if tr is None:
+                    kept_finals[st] = w
+                    finals[st] = w / total if total > 0.0 else w
+                else:
+                    kept_transitions.append(tr)
+                    transitions.append(Transition(tr.src, tr.dest, tr.symbol, \
+                        w / total if total > 0.0 else w))
+
+        orig = matrix_wfa.MatrixWFA(copy.deepcopy(self._transitions), dict(self._finals), dict(self._start))
+        rest = matrix_wfa.MatrixWFA(copy.deepcopy(kept_transitions), kept_finals, dict(self._start))
+        mass = []
+        for aut in (orig, rest):
+            aut.rename_states()
+            mass.append(aut.compute_language_probability(matrix_wfa.ClosureMode.solve, True))
+        bound = min(1.0, 2*max(0.0, mass[0] - mass[1]))
+
+        return type(self)(transitions, finals, dict(self._start), copy.copy(self.get_alphabet())), bound
+
+
+    def get_compiled_dpa(self):
+        """!
+        Get the compiled (table-based) form of the DPA suitable for a fast
+        scoring of words. The compiled form is cached until the WFA is
+        modified.
+
+        @return Compiled DPA (compiled_dpa.CompiledDPA)
+        """
+        if self._compiled is None:
+            import wfa.compiled_dpa as compiled_dpa
+            self._compiled = compiled_dpa.CompiledDPA.from_wfa(self)
+        return self._compiled
+
+
+    def get_finite_distribution(self) -> Optional[dict[tuple, float]]:
+        """!
+        Get the weights of all words of a tree-shaped WFA (e.g., a prefix tree
+        acceptor), i.e., of a WFA where each state has at most one incoming
+        transition and initial states have none. The language of such WFA is
+        finite and its size is bounded by the number of states. The result is
+        cached until the WFA is modified.
+
+        @return Dictionary: Word (tuple of symbols) -> weight (only words with
+            nonzero weight), None if the WFA is not tree-shaped
+        """
+        if self._distribution is None:
+            self._distribution = (self._compute_finite_distribution(),)
+        return self._distribution[0]
+
+
+    def _compute_finite_distribution(self) -> Optional[dict[tuple, float]]:
+        """!
+        Compute the weights of all words of a tree-shaped WFA (see
+        get_finite_distribution).
+
+        @return Dictionary: Word -> weight, None if the WFA is not tree-shaped
+        """
+        pred = self.get_predecessors_transitions()
+        for st in self.get_states():
+            if len(pred.get(st, [])) > (0 if st in self._start else 1):
+                return None
+
+        succ = self.get_dictionary_transitions()
+        ret: dict[tuple, float] = defaultdict(float)
+        stack = [(st, (), w) for st, w in self._start.items()]
+        while stack:
+            st, word, weight = stack.pop()
+            fin = self._finals.get(st, 0.0)
+            if fin * weight != 0.0:
+                ret[word] += fin * weight
+            for tr in succ.get(st, []):
+                if tr.weight != 0.0:
+                    stack.append((tr.dest, word + (tr.symbol,), weight * tr.weight))
+        return dict(ret)
+
+
+    def sample(self, n: int, rng=None, max_length: int=1000) -> List[tuple]:
+        """!
+        Draw n words from the distribution given by the DPA (see
+        compiled_dpa.CompiledDPA.sample).
+
+        @param n: Number of words
+        @param rng: Random number generator (numpy.random.Generator)
+        @param max_length: Maximum length of a word (longer words are truncated)
+
+        @return List of words (tuples of symbols)
+        """
+        return self.get_compiled_dpa().sample(n, rng, max_length)
+
+
     def map_symbols(self, fnc: Callable):
         """!
         Apply the function fnc on the symbols of all transitions
@@ -658,38 +1096,132 @@ class CoreWFA(Generic[StateType, SymbolType]):
         """
         for tr in self.get_transitions():
             tr.symbol = fnc(tr.symbol)
+        self._invalidate_cache()
 
 
-    def get_most_probable_string(self) -> List[SymbolType]:
+    def get_most_probable_string(self) -> Tuple[List[SymbolType], float]:
         """!
         Compute the most probable word of the DPA
 
-        @return A word with a highest probability
+        @return A word with a highest probability together with its probability
         """
+        best = self.get_k_most_probable_strings(1)
+        if len(best) == 0:
+            return [], 0.0
+        return best[0]
 
-        assert(self.is_deterministic())
 
-        val: dict[StateType, float] = defaultdict(lambda: 0.0)
-        words: dict[StateType, List[SymbolType]] = dict()
+    def get_k_most_probable_strings(self, k: int) -> List[Tuple[List[SymbolType], float]]:
+        """!
+        Compute k most probable words of the DPA. For a nondeterministic WFA,
+        the k most probable paths are returned (a word may then occur more than
+        once).
+
+        @param k: Number of words
 
-        if len(self._finals) == 0:
-            return [], 0.0
+        @return List of pairs (word, probability) sorted from the most probable one
+        """
+        tr_dict = self.get_dictionary_transitions()
+        return CoreWFA._k_best_search(self._start.items(), \
+            lambda st: [(tr.symbol, tr.weight, tr.dest) for tr in tr_dict.get(st, [])], \
+            lambda st: self._finals.get(st, 0.0), k)
+
+
+    def get_k_most_probable_difference(self, diff: "CoreWFA", k: int) -> List[Tuple[List[SymbolType], float]]:
+        """!
+        Compute k most probable words of the difference automaton (see
+        difference_dwfa) without constructing it. Pairs (state of self, state
+        of diff or an implicit sink) are explored on demand during the search.
+        A word is accepted by the difference iff it is accepted by self and
+        it is not accepted by diff with a nonzero weight.
+
+        @param diff: Second automaton
+        @param k: Number of words
+
+        @return List of pairs (word, probability) sorted from the most probable one
+        """
+        assert(self.is_deterministic())
+        assert(diff.is_deterministic())
 
-        for k, v in self._finals.items():
-            val[k] = v
-            words[k] = []
+        tr_dict = self.get_dictionary_transitions()
+        diff_dict = diff.get_state_symbol_dict()
+        diff_finals = diff.get_finals()
+        sink = _DifferenceSink()
+
+        def successors(pair):
+            st, dst = pair
+            ret = []
+            for tr in tr_dict.get(st, []):
+                dest = sink
+                if dst is not sink and tr.symbol in diff_dict.get(dst, dict()):
+                    dest = next(iter(diff_dict[dst][tr.symbol])).dest
+                ret.append((tr.symbol, tr.weight, (tr.dest, dest)))
+            return ret
+
+        def final_weight(pair):
+            st, dst = pair
+            if dst is not sink and diff_finals.get(dst, 0.0) > 0.0:
+                return 0.0
+            return self._finals.get(st, 0.0)
+
+        dst_start = next(iter(diff.get_starts().keys()), sink)
+        starts = [((st, dst_start), weight) for st, weight in self._start.items()]
+        return CoreWFA._k_best_search(starts, successors, final_weight, k)
+
+
+    @staticmethod
+    def _k_best_search(starts, successors: Callable, final_weight: Callable, k: int) -> List[Tuple[List[SymbolType], float]]:
+        """!
+        Best-first (Dijkstra) search for k most probable paths in the
+        negative-log space. Each state is expanded at most k times and the
+        search stops as soon as k paths are found. Words are reconstructed
+        from back-pointers. Weights are assumed to be from [0,1].
 
-        changed = True
-        while changed:
-            changed = False
-            for tr in self.get_transitions():
-                if val[tr.src] < val[tr.dest]*tr.weight:
-                    val[tr.src] = val[tr.dest]*tr.weight
-                    words[tr.src] = [tr.symbol] + words[tr.dest]
-                    changed = True
+        @param starts: Initial states with weights (pairs (state, weight))
+        @param successors: Function State -> list of triples (symbol, weight, state)
+        @param final_weight: Function State -> final weight
+        @param k: Number of paths
 
-        ini = list(self._start.keys())[0]
-        return words[ini], val[ini]
+        @return List of pairs (word, probability) sorted from the most probable one
+        """
+        #Back-pointers: entry -> (symbol, parent entry)
+        entries: List[Tuple[Optional[SymbolType], int]] = []
+        heap: List[Tuple[float, int, Optional[StateType], bool]] = []
+        expanded: dict[StateType, int] = defaultdict(lambda: 0)
+        ret: List[Tuple[List[SymbolType], float]] = []
+
+        for st, weight in starts:
+            if weight > 0.0:
+                entries.append((None, -1))
+                heapq.heappush(heap, (-math.log(weight), len(entries)-1, st, False))
+
+        while heap and len(ret) < k:
+            cost, entry, state, accept = heapq.heappop(heap)
+            if accept:
+                word = []
+                act = entries[entry][1]
+                while act >= 0:
+                    sym, parent = entries[act]
+                    if parent >= 0:
+                        word.append(sym)
+                    act = parent
+                word.reverse()
+                ret.append((word, math.exp(-cost)))
+                continue
+
+            expanded[state] += 1
+            if expanded[state] > k:
+                continue
+
+            fin = final_weight(state)
+            if fin > 0.0:
+                entries.append((None, entry))
+                heapq.heappush(heap, (cost - math.log(fin), len(entries)-1, None, True))
+            for sym, weight, dest in successors(state):
+                if weight > 0.0:
+                    entries.append((sym, entry))
+                    heapq.heappush(heap, (cost - math.log(weight), len(entries)-1, dest, False))
+        return ret
 
 
     def set_ones(self) -> None:
@@ -699,6 +1231,7 @@ class CoreWFA(Generic[StateType, SymbolType]):
 
         for tr in self._transitions:
             tr.weight = 1.0
+        self._invalidate_cache()
 
 
     def complete_wfa(self, trap: StateType) -> None:
@@ -727,6 +1260,7 @@ class CoreWFA(Generic[StateType, SymbolType]):
             trans.append(Transition(trap, trap, al, 0.0))
         self._transitions = trans
         self._states = self._get_states()
+        self._invalidate_cache()
 
 
     def difference_dwfa(self, diff: "CoreWFA") -> "CoreWFA":
@@ -756,4 +1290,4 @@ class CoreWFA(Generic[StateType, SymbolType]):
                 nfin[st] = 1.0
         but.set_finals(nfin)
 
-        return self.product(but).get_trim_automaton()
+        return self.product(but, trim=True)
@@ -23,12 +23,12 @@
     If not, see <http://www.gnu.org/licenses/>.
 """
 
+import io
 import wfa.aux_functions as aux
-import FAdo.fa
 import wfa.wfa_exceptions as wfa_exceptions
 import wfa.core_wfa as core_wfa
 
-from typing import List, Optional, Set, TypeVar, Generic, Callable, Tuple, Union
+from typing import List, Optional, Set, TypeVar, Generic, Callable, Tuple, Union, TextIO
 
 PrintSymbolType = Union[core_wfa.SymbolType, List[core_wfa.SymbolType]]
 
@@ -40,6 +40,45 @@ PrintSymbolType = Union[core_wfa.SymbolType, List[core_wfa.SymbolType]]
 PRECISE = 3
 ## Max number of symbols on transition (DOT format)
 SYMBOLS = 25
+## Number of buffered lines written to a file at once
+CHUNK = 4096
+
+
+class ChunkedWriter:
+    """!
+    Writer buffering strings and writing them to a file object in chunks
+    """
+
+    def __init__(self, out: TextIO, chunk: int=CHUNK):
+        """!
+        Constructor
+
+        @param out: File object
+        @param chunk: Number of buffered strings written at once
+        """
+        self.out = out
+        self.chunk = chunk
+        self._buffer: List[str] = []
+
+
+    def write(self, text: str):
+        """!
+        Write a string (the buffer is flushed if it is full).
+
+        @param text: String to be written
+        """
+        self._buffer.append(text)
+        if len(self._buffer) >= self.chunk:
+            self.flush()
+
+
+    def flush(self):
+        """!
+        Write all buffered strings to the file object.
+        """
+        self.out.write("".join(self._buffer))
+        self._buffer.clear()
+
 
 class CoreWFAExport(core_wfa.CoreWFA[core_wfa.StateType, core_wfa.SymbolType]):
     """!
@@ -78,7 +117,7 @@ class CoreWFAExport(core_wfa.CoreWFA[core_wfa.StateType, core_wfa.SymbolType]):
         return aggregate
 
 
-    def to_dot(self, aggregate: bool=True, state_label: Optional[dict[core_wfa.StateType, str]]=None, legend: str=None) -> str:
+    def to_dot(self, aggregate: bool=True, state_label: Optional[dict[core_wfa.StateType, str]]=None, legend: str=None, max_states: Optional[int]=None, max_edges: Optional[int]=None) -> str:
         """!
         Convert the WFA to dot format (for graphical visualization). Use
         aggregation of transitions between same states.
@@ -86,64 +125,89 @@ class CoreWFAExport(core_wfa.CoreWFA[core_wfa.StateType, core_wfa.SymbolType]):
         @param aggregate: Aggregate transitions between two states
         @param state_label: label of each state (shown inside of the state)
         @param legend: Optional legend to be part of the DOT automaton
+        @param max_states: Maximum number of shown states (None = unlimited)
+        @param max_edges: Maximum number of shown edges (None = unlimited)
 
         @return String (DOT, Graphwiz format)
         """
-        dot = str()
-        dot += "digraph \" Automat \" {\n    rankdir=LR;\n"
-        if legend is not None:
-            dot += "{{ rank = LR\n Legend [shape=none, margin=0, label=\"{0}\"] }}\n".format(legend)
-        dot += "node [shape = doublecircle];\n"
-        if len(self._finals) > 0:
-            for state, weight in self._finals.items():
-                if weight == 0.0:
-                    continue
-                if state_label is None:
-                    dot += "\"" + str(state) + "\"" + " [label=\"" \
-                        + str(state) + ", " \
-                        + str(round(weight, PRECISE)) + "\"]"
-                else:
-                    dot += "\"" + str(state) + "\"" + " [label=\"" \
-                        + str(state) + ": " \
-                        + "{0}, {1}".format(round(weight, PRECISE),state_label[state]) + "\"]"
-                dot += ";\n"
-
-        dot += "node [shape = circle];\n"
-        if state_label is not None:
-            for state in self.get_states():
-                if state not in self._finals:
-                    dot += "\"" + str(state) + "\"" + " [label=\"" \
-                        + str(state) + ", " \
-                        + "{0}".format(state_label[state]) + "\"]"
-                    dot += ";\n"
-        else:
-            for state in self.get_states():
-                if state not in self._finals:
-                    dot += "\"" + str(state) + "\"" + " [label=\"" \
-                        + str(state) + "\"]"
-                    dot += ";\n"
+        out = io.StringIO()
+        self.write_dot(out, aggregate, state_label, legend, max_states, max_edges)
+        return out.getvalue()
 
 
+    def write_dot(self, out: TextIO, aggregate: bool=True, state_label: Optional[dict[core_wfa.StateType, str]]=None, legend: str=None, max_states: Optional[int]=None, max_edges: Optional[int]=None):
+        """!
+        Write the WFA in dot format (for graphical visualization) to a file
+        object. The output is written in chunks. If the number of states
+        (edges) is limited, only the first max_states states in the BFS order
+        from the initial states (the first max_edges edges between them) are
+        written and the number of omitted states and edges is shown in the
+        graph.
+
+        @param out: File object
+        @param aggregate: Aggregate transitions between two states
+        @param state_label: label of each state (shown inside of the state)
+        @param legend: Optional legend to be part of the DOT automaton
+        @param max_states: Maximum number of shown states (None = unlimited)
+        @param max_edges: Maximum number of shown edges (None = unlimited)
+        """
+        writer = ChunkedWriter(out)
+        shown = None
+        num_states = len(self.get_states())
+        if max_states is not None and num_states > max_states:
+            shown = set(self.get_state_order(core_wfa.StateOrder.bfs)[:max_states])
+
+        writer.write("digraph \" Automat \" {\n    rankdir=LR;\n")
+        if legend is not None:
+            writer.write("{{ rank = LR\n Legend [shape=none, margin=0, label=\"{0}\"] }}\n".format(legend))
+        writer.write("node [shape = doublecircle];\n")
+        for state, weight in self._finals.items():
+            if weight == 0.0 or (shown is not None and state not in shown):
+                continue
+            if state_label is None:
+                writer.write("\"{0}\" [label=\"{0}, {1}\"];\n".format(state, round(weight, PRECISE)))
+            else:
+                writer.write("\"{0}\" [label=\"{0}: {1}, {2}\"];\n".format(state, round(weight, PRECISE), state_label[state]))
+
+        writer.write("node [shape = circle];\n")
+        for state in self.get_states():
+            if state in self._finals or (shown is not None and state not in shown):
+                continue
+            if state_label is not None:
+                writer.write("\"{0}\" [label=\"{0}, {1}\"];\n".format(state, state_label[state]))
+            else:
+                writer.write("\"{0}\" [label=\"{0}\"];\n".format(state))
+
         for state, weight in self.get_starts().items():
-            dot += "\"init{0}\" [label=\"{1}\",shape=plaintext];".format(state, weight)
-            dot += "\"init{0}\" -> \"{1}\";\n".format(state, state)
+            if shown is not None and state not in shown:
+                continue
+            writer.write("\"init{0}\" [label=\"{1}\",shape=plaintext];".format(state, weight))
+            writer.write("\"init{0}\" -> \"{1}\";\n".format(state, state))
 
-        #dot += "node [shape = circle];\n"
         if aggregate:
-            src: core_wfa.StateType
-            dest: core_wfa.StateType
-            res: Tuple[List[core_wfa.SymbolType], float]
-            for (src, dest), res in self.get_aggregated_transitions().items():
-                dot += self._print_transition(src, dest, res[0], res[1])
+            edges = ((src, dest, sym, weight) for (src, dest), (sym, weight) \
+                in self.get_aggregated_transitions().items())
         else:
-            for tr in self.get_transitions():
-                dot += self._print_transition(tr.src, tr.dest, tr.symbol, tr.weight)
-
-        dot += "}"
-        return dot
-
-
-    def _print_transition(self, src: core_wfa.StateType, dest: core_wfa.StateType, sym: PrintSymbolType, weight: float) -> str:
+            edges = ((tr.src, tr.dest, tr.symbol, tr.weight) for tr in self.get_transitions())
+        alphabet = set(self.get_alphabet())
+        num_edges = 0
+        omitted_edges = 0
+        for src, dest, sym, weight in edges:
+            if (shown is not None and (src not in shown or dest not in shown)) or \
+                (max_edges is not None and num_edges >= max_edges):
+                omitted_edges += 1
+                continue
+            writer.write(self._print_transition(src, dest, sym, weight, alphabet))
+            num_edges += 1
+
+        omitted_states = 0 if shown is None else num_states - len(shown)
+        if omitted_states > 0 or omitted_edges > 0:
+            writer.write("\"omitted\" [shape=none, label=\"... {0} states and {1} edges omitted\"];\n".format(omitted_states, omitted_edges))
+        writer.write("}")
+        writer.flush()
+
+
+    def _print_transition(self, src: core_wfa.StateType, dest: core_wfa.StateType, sym: PrintSymbolType, weight: float, alphabet: Optional[Set[core_wfa.SymbolType]]=None) -> str:
         """!
         Print a single transition.
 
@@ -151,16 +215,12 @@ class CoreWFAExport(core_wfa.CoreWFA[core_wfa.StateType, core_wfa.SymbolType]):
         @param dest: Destination state
         @param sym: Symbol
         @param weight: Weight of the transition
+        @param alphabet: Set of symbols of the alphabet (computed if None)
 
         @return Transition in DOT format
         """
-        dot = str()
-        dot += "\"" + str(src) + "\""
-        dot += " -> "
-        dot += "\"" + str(dest) + "\""
-        dot += " [ label = \"" + self._format_label(sym, weight)
-        dot += "\" ];\n"
-        return dot
+        return "\"{0}\" -> \"{1}\" [ label = \"{2}\" ];\n".format(src, dest, \
+            self._format_label(sym, weight, alphabet))
 
 
     def to_fa_format(self, initial: bool=False, alphabet: bool=False) -> str:
@@ -172,31 +232,42 @@ class CoreWFAExport(core_wfa.CoreWFA[core_wfa.StateType, core_wfa.SymbolType]):
 
         @return String (WFA in the FA format)
         """
+        out = io.StringIO()
+        self.write_fa_format(out, initial, alphabet)
+        return out.getvalue()
+
+
+    def write_fa_format(self, out: TextIO, initial: bool=False, alphabet: bool=False):
+        """!
+        Write the automaton in FA format (WFA version) to a file object. The
+        output is written in chunks.
+
+        @param out: File object
+        @param initial: Explicitly print the initial state
+        @param alphabet: Whether show explicitly symbols from alphabet.
+        """
         if len(self._start) != 1:
             raise wfa_exceptions.WFAOperationException("Only WFA with a single initial state can be converted to FA format.")
-        fa = str()
+        writer = ChunkedWriter(out)
         if initial:
-            fa += str(list(self._start.keys())[0]) + "\n"
+            writer.write(str(list(self._start.keys())[0]) + "\n")
         if alphabet:
-            fa += ":"
-            for sym in self.get_alphabet():
-                fa += hex(sym) + " "
-            fa += "\n"
+            writer.write(":" + "".join(hex(sym) + " " for sym in self.get_alphabet()) + "\n")
         for transition in self._transitions:
-            fa += "{0} {1} \"{2}\" {3}\n".format(transition.src, transition.dest,
-                transition.symbol, transition.weight)
+            writer.write("{0} {1} \"{2}\" {3}\n".format(transition.src, transition.dest,
+                transition.symbol, transition.weight))
         for final, weight in self._finals.items():
-            fa += "{0} {1}\n".format(final, weight)
-
-        return fa
+            writer.write("{0} {1}\n".format(final, weight))
+        writer.flush()
 
 
-    def _format_label(self, sym: PrintSymbolType, weight: float) -> str:
+    def _format_label(self, sym: PrintSymbolType, weight: float, alphabet: Optional[Set[core_wfa.SymbolType]]=None) -> str:
         """!
         Format label for DOT converting.
 
         @param sym: List of symbols
         @param weight: Weight of the transition.
+        @param alphabet: Set of symbols of the alphabet (computed if None)
 
         @return String (formatted label in the DOT format)
         """
@@ -205,7 +276,9 @@ class CoreWFAExport(core_wfa.CoreWFA[core_wfa.StateType, core_wfa.SymbolType]):
         if not isinstance(sym, list):
             return "{0} {1}".format(str(sym), round(weight, 2))
         sym_str = str()
-        if set(sym) == set(self.get_alphabet()):
+        if alphabet is None:
+            alphabet = set(self.get_alphabet())
+        if set(sym) == alphabet:
             return "^[] " + str(round(weight, PRECISE))
         for char in sorted(sym):
             if max_symbols > 0:
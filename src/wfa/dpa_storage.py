@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+"""!
+\brief Binary storage of compiled deterministic PAs
+
+\details
+    Compact binary format of (maps of) compiled deterministic PAs. A file
+    consists of a fixed prefix (magic, version, header length), a JSON header
+    with an interned symbol table shared by all stored PAs and offsets of
+    arrays, and a data section with the arrays of the PAs (symbol codes,
+    next-state table, log-weight table, final log-weights) aligned to
+    ALIGNMENT bytes. Weights can be stored as float32. When a file is loaded,
+    the arrays are memory-mapped (no per-edge objects are created), so
+    processes loading the same file share its pages.
+
+\author Vojtěch Havlena
+
+\copyright
+    Copyright (C) 2020  Vojtech Havlena, <ihavlena@fit.vutbr.cz>\n
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.\n
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.\n
+    You should have received a copy of the GNU General Public License.
+    If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import struct
+import numpy
+import wfa.compiled_dpa as compiled_dpa
+import wfa.wfa_exceptions as wfa_exceptions
+
+from typing import Any, List, Optional, Tuple
+
+## Magic bytes of the file
+MAGIC = b"DPAF"
+## Version of the format
+VERSION = 1
+## Prefix of the file: magic, version, length of the header
+PREFIX = struct.Struct("<4sIQ")
+## Alignment (in bytes) of the data section and of the arrays
+ALIGNMENT = 64
+
+ModelMapType = dict[Any, List[Optional[compiled_dpa.CompiledDPA]]]
+
+
+def _align(offset: int) -> int:
+    """!
+    Round an offset up to a multiple of ALIGNMENT.
+
+    @param offset: Offset
+
+    @return Aligned offset
+    """
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _encode(obj: Any) -> Any:
+    """!
+    Encode a symbol or a key (built from strings, numbers, None, tuples and
+    frozensets) to a JSON value.
+
+    @param obj: Object to be encoded
+
+    @return JSON value
+    """
+    if isinstance(obj, tuple):
+        return {"t": [_encode(item) for item in obj]}
+    if isinstance(obj, frozenset):
+        return {"f": sorted((_encode(item) for item in obj), key=json.dumps)}
+    if obj is None or isinstance(obj, (str, int, float)):
+        return obj
+    raise wfa_exceptions.WFAOperationException("Cannot store a value of type {0}".format(type(obj).__name__))
+
+
+def _decode(val: Any) -> Any:
+    """!
+    Decode a JSON value created by _encode.
+
+    @param val: JSON value
+
+    @return Decoded object
+    """
+    if isinstance(val, dict):
+        if "t" in val:
+            return tuple(_decode(item) for item in val["t"])
+        return frozenset(_decode(item) for item in val["f"])
+    return val
+
+
+def write_models(filename: str, models: ModelMapType, float32: bool=False):
+    """!
+    Store a map of compiled PAs (e.g., golden automata of communication
+    pairs) in the binary format.
+
+    @param filename: Name of the file
+    @param models: Map: key -> list of compiled PAs (None items are allowed)
+    @param float32: Store weights as float32 (instead of float64)
+    """
+    wtype = numpy.dtype(numpy.float32 if float32 else numpy.float64)
+    symbols: dict[Any, int] = dict()
+    arrays: List[numpy.ndarray] = []
+    groups = []
+    offset = 0
+
+    def add_array(arr: numpy.ndarray) -> int:
+        nonlocal offset
+        start = offset
+        arrays.append(arr)
+        offset = _align(offset + arr.nbytes)
+        return start
+
+    for key, dpas in models.items():
+        items = []
+        for dpa in dpas:
+            if dpa is None:
+                items.append(None)
+                continue
+            codes = numpy.array([symbols.setdefault(sym, len(symbols)) for sym in dpa.symbols], dtype=numpy.int32)
+            items.append({
+                "states": dpa.num_states(),
+                "symbols": len(dpa.symbols),
+                "start": int(dpa.start),
+                "log_start": float(dpa.log_start),
+                "codes": add_array(codes),
+                "next": add_array(numpy.ascontiguousarray(dpa.next_state, dtype=numpy.int32)),
+                "weight": add_array(numpy.ascontiguousarray(dpa.log_weight, dtype=wtype)),
+                "final": add_array(numpy.ascontiguousarray(dpa.log_final, dtype=wtype)),
+            })
+        groups.append({"key": _encode(key), "models": items})
+
+    header = json.dumps({"weights": wtype.name, "symbols": [_encode(sym) for sym in symbols], \
+        "groups": groups}).encode("utf-8")
+    base = _align(PREFIX.size + len(header))
+    with open(filename, "wb") as fd:
+        fd.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+        fd.write(header)
+        fd.write(bytes(base - PREFIX.size - len(header)))
+        pos = 0
+        for arr in arrays:
+            fd.write(arr.tobytes())
+            pos += arr.nbytes
+            fd.write(bytes(_align(pos) - pos))
+            pos = _align(pos)
+
+
+def read_models(filename: str) -> ModelMapType:
+    """!
+    Load a map of compiled PAs stored by write_models. Tables of the PAs are
+    read-only arrays memory-mapped from the file.
+
+    @param filename: Name of the file
+
+    @return Map: key -> list of compiled PAs
+
+    @throw WFAOperationException if the file is not in the binary format
+    """
+    if os.path.getsize(filename) < PREFIX.size:
+        raise wfa_exceptions.WFAOperationException("File {0} is not a DPA model file".format(filename))
+    data = numpy.memmap(filename, dtype=numpy.uint8, mode="r")
+    magic, version, length = PREFIX.unpack(bytes(data[:PREFIX.size]))
+    if magic != MAGIC:
+        raise wfa_exceptions.WFAOperationException("File {0} is not a DPA model file".format(filename))
+    if version != VERSION:
+        raise wfa_exceptions.WFAOperationException("Unsupported version {0} of the DPA model file {1}".format(version, filename))
+    header = json.loads(bytes(data[PREFIX.size:PREFIX.size+length]).decode("utf-8"))
+    base = _align(PREFIX.size + length)
+    wtype = numpy.dtype(header["weights"])
+    symbols = [_decode(sym) for sym in header["symbols"]]
+
+    def get_array(offset: int, dtype: numpy.dtype, shape: Tuple[int, ...]) -> numpy.ndarray:
+        start = base + offset
+        return data[start:start + dtype.itemsize*int(numpy.prod(shape))].view(dtype).reshape(shape)
+
+    models: ModelMapType = dict()
+    for group in header["groups"]:
+        dpas: List[Optional[compiled_dpa.CompiledDPA]] = []
+        for item in group["models"]:
+            if item is None:
+                dpas.append(None)
+                continue
+            shape = (item["states"], item["symbols"])
+            codes = get_array(item["codes"], numpy.dtype(numpy.int32), (item["symbols"],))
+            dpas.append(compiled_dpa.CompiledDPA([symbols[c] for c in codes.tolist()], \
+                get_array(item["next"], numpy.dtype(numpy.int32), shape), \
+                get_array(item["weight"], wtype, shape), \
+                get_array(item["final"], wtype, (item["states"],)), \
+                item["start"], item["log_start"]))
+        models[_decode(group["key"])] = dpas
+    return models
+
+
+def write_dpa(filename: str, dpa: compiled_dpa.CompiledDPA, float32: bool=False):
+    """!
+    Store a single compiled PA in the binary format.
+
+    @param filename: Name of the file
+    @param dpa: Compiled PA
+    @param float32: Store weights as float32 (instead of float64)
+    """
+    write_models(filename, {None: [dpa]}, float32)
+
+
+def read_dpa(filename: str) -> compiled_dpa.CompiledDPA:
+    """!
+    Load a single compiled PA stored by write_dpa.
+
+    @param filename: Name of the file
+
+    @return Compiled PA (with memory-mapped tables)
+    """
+    models = read_models(filename)
+    dpas = [dpa for lst in models.values() for dpa in lst if dpa is not None]
+    if len(dpas) != 1:
+        raise wfa_exceptions.WFAOperationException("File {0} does not contain a single PA".format(filename))
+    return dpas[0]
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+
+"""!
+\brief Linear solvers for language weights of WFAs
+
+\details
+    Solvers of the linear system (I-M)*x = b, where M is a transition matrix
+    of a WFA. Weights of languages are obtained from the solution of this
+    system (without computing the closure (I-M)^{-1}). Provides dense LU,
+    sparse direct, Krylov (GMRES, BiCGSTAB) and truncated Neumann series
+    backends together with an automatic selection of the backend based on the
+    number of states and the density of the matrix. Systems of acyclic
+    automata are solved by a back substitution in a topological order, other
+    systems can be decomposed to strongly connected components (only small
+    per-component systems are then solved).
+
+\author Vojtěch Havlena
+
+\copyright
+    Copyright (C) 2020  Vojtech Havlena, <ihavlena@fit.vutbr.cz>\n
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.\n
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.\n
+    You should have received a copy of the GNU General Public License.
+    If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import numpy
+import scipy.sparse
+import scipy.sparse.linalg
+import algorithms.reachability as reachability
+
+from enum import Enum
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+MatrixType = Union[numpy.ndarray, numpy.matrix, scipy.sparse.spmatrix]
+
+## Systems with at most this number of states are solved by the dense LU
+DENSE_STATES = 400
+## Matrices with at least this density are solved by the dense LU
+DENSE_DENSITY = 0.1
+## Systems with more states are solved by a Krylov method (instead of the
+## sparse direct solver)
+DIRECT_STATES = 20000
+## Systems whose largest strongly connected component has at most this
+## fraction of states are solved by the SCC decomposition
+SCC_FRACTION = 0.5
+## Default relative tolerance of iterative solvers and of the residual check
+TOLERANCE = 1e-10
+## Default maximum number of iterations of iterative solvers
+MAX_ITERATIONS = 1000
+
+
+class SolverBackend(Enum):
+    """!
+    Backends for solving (I-M)*x = b.
+    """
+
+    ## Select the backend according to the size and density of the matrix
+    auto = 0
+    ## Dense LU decomposition
+    dense_lu = 1
+    ## Sparse LU decomposition
+    sparse_direct = 2
+    ## Generalized minimal residual method
+    gmres = 3
+    ## Biconjugate gradient stabilized method
+    bicgstab = 4
+    ## Truncated Neumann series x = b + M*b + M^2*b + ...
+    neumann = 5
+    ## Back substitution in a topological order (acyclic automata only)
+    acyclic = 6
+    ## Block back substitution over strongly connected components
+    scc = 7
+
+
+class SolverResult(NamedTuple):
+    """!
+    Solution of (I-M)*x = b together with solver statistics
+    """
+    ## Solution
+    x: numpy.ndarray
+    ## Used backend
+    backend: SolverBackend
+    ## Number of iterations (0 for direct solvers)
+    iterations: int
+    ## Relative residual ||(I-M)*x - b|| / ||b|| (infinity norm)
+    residual: float
+    ## Number of nonzero entries of the LU factors (0 for solvers without a
+    ## factorization)
+    fill_in: int = 0
+    ## Time (in seconds) spent by factorizations
+    factor_time: float = 0.0
+
+
+def topological_levels(mtx: MatrixType) -> Optional[List[numpy.ndarray]]:
+    """!
+    Split states of an acyclic automaton given by its transition matrix into
+    levels such that all successors of a state are in the previous levels
+    (the first level contains states without successors).
+
+    @param mtx: Transition matrix
+
+    @return List of levels (arrays of states), None if the automaton has a
+        cycle (including self-loops)
+    """
+    csc = scipy.sparse.csc_matrix(mtx, dtype=numpy.float64)
+    csc.eliminate_zeros()
+    outdeg = numpy.bincount(csc.indices, minlength=csc.shape[0])
+    levels = []
+    head = numpy.nonzero(outdeg == 0)[0]
+    done = 0
+    while len(head) > 0:
+        levels.append(head)
+        done += len(head)
+        preds = csc[:, head].indices
+        numpy.subtract.at(outdeg, preds, 1)
+        head = numpy.unique(preds[outdeg[preds] == 0])
+    if done < csc.shape[0]:
+        return None
+    return levels
+
+
+def scc_levels(mtx: MatrixType) -> List[List[numpy.ndarray]]:
+    """!
+    Decompose states of an automaton given by its transition matrix to
+    strongly connected components (Tarjan's algorithm) and group the
+    components into levels of the condensation such that all successors of
+    a component are in the previous levels.
+
+    @param mtx: Transition matrix
+
+    @return List of levels (each level is a list of components, i.e., arrays
+        of states)
+    """
+    csr = scipy.sparse.csr_matrix(mtx, dtype=numpy.float64)
+    csr.eliminate_zeros()
+    num_states = csr.shape[0]
+    rows = numpy.repeat(numpy.arange(num_states), numpy.diff(csr.indptr))
+    graph = reachability.Reachability(num_states, zip(rows.tolist(), csr.indices.tolist()))
+    comps = graph.strongly_connected_components()
+
+    comp_of = [0] * num_states
+    level = [0] * len(comps)
+    for i, comp in enumerate(comps):
+        lv = 0
+        for v in comp:
+            comp_of[v] = i
+        for v in comp:
+            for w in graph.succ[v]:
+                j = comp_of[w]
+                if j != i and level[j] >= lv:
+                    lv = level[j] + 1
+        level[i] = lv
+
+    levels: List[List[numpy.ndarray]] = [[] for _ in range(max(level, default=-1) + 1)]
+    for i, comp in enumerate(comps):
+        levels[level[i]].append(numpy.array(comp, dtype=numpy.int64))
+    return levels
+
+
+def select_backend(mtx: MatrixType) -> SolverBackend:
+    """!
+    Select a backend according to the number of states and the density of
+    the transition matrix.
+
+    @param mtx: Transition matrix
+
+    @return Selected backend
+    """
+    num_states = mtx.shape[0]
+    if num_states <= DENSE_STATES:
+        return SolverBackend.dense_lu
+    nnz = mtx.nnz if scipy.sparse.issparse(mtx) else numpy.count_nonzero(mtx)
+    if nnz >= DENSE_DENSITY * num_states * num_states:
+        return SolverBackend.dense_lu
+    if num_states <= DIRECT_STATES:
+        return SolverBackend.sparse_direct
+    return SolverBackend.gmres
+
+
+def _auto_backend(mtx: MatrixType) -> Tuple[SolverBackend, Optional[list]]:
+    """!
+    Select a backend automatically: acyclic systems are solved by the back
+    substitution, systems too large for the sparse LU that decompose to
+    small strongly connected components by the SCC decomposition (the
+    iterative solvers converge slowly on the nearly stochastic loops
+    of products), the others according to select_backend.
+
+    @param mtx: Transition matrix
+
+    @return Pair (backend, levels for the acyclic/SCC backends or None)
+    """
+    levels = topological_levels(mtx)
+    if levels is not None:
+        return SolverBackend.acyclic, levels
+    backend = select_backend(mtx)
+    if backend == SolverBackend.gmres:
+        comps = scc_levels(mtx)
+        largest = max(len(comp) for level in comps for comp in level)
+        if largest <= SCC_FRACTION * mtx.shape[0]:
+            return SolverBackend.scc, comps
+    return backend, None
+
+
+def residual(mtx: MatrixType, x: numpy.ndarray, b: numpy.ndarray) -> float:
+    """!
+    Compute the relative residual of a solution of (I-M)*x = b.
+
+    @param mtx: Transition matrix M
+    @param x: Solution
+    @param b: Right-hand side
+
+    @return Relative residual (infinity norm)
+    """
+    res = x - numpy.asarray(mtx.dot(x)).ravel() - b
+    norm = numpy.abs(b).max() if len(b) > 0 else 0.0
+    err = numpy.abs(res).max() if len(res) > 0 else 0.0
+    return float(err / norm) if norm > 0.0 else float(err)
+
+
+def _solve_dense(mtx: MatrixType, b: numpy.ndarray) -> numpy.ndarray:
+    """!
+    Solve (I-M)*x = b using the dense LU decomposition.
+
+    @param mtx: Transition matrix M
+    @param b: Right-hand side
+
+    @return Solution
+    """
+    if scipy.sparse.issparse(mtx):
+        mtx = mtx.toarray()
+    return numpy.linalg.solve(numpy.identity(mtx.shape[0]) - numpy.asarray(mtx), b)
+
+
+def _solve_sparse(mtx: MatrixType, b: numpy.ndarray) -> Tuple[numpy.ndarray, int, float]:
+    """!
+    Solve (I-M)*x = b using the sparse LU decomposition.
+
+    @param mtx: Transition matrix M
+    @param b: Right-hand side
+
+    @return Triple (solution, number of nonzeros of the LU factors,
+        factorization time)
+    """
+    identity = scipy.sparse.identity(mtx.shape[0], dtype=numpy.float64, format="csc")
+    op = (identity - scipy.sparse.csc_matrix(mtx)).tocsc()
+    start = time.perf_counter()
+    try:
+        lu_obj = scipy.sparse.linalg.splu(op)
+    except RuntimeError as e:
+        raise numpy.linalg.LinAlgError(str(e))
+    elapsed = time.perf_counter() - start
+    return lu_obj.solve(b), lu_obj.L.nnz + lu_obj.U.nnz, elapsed
+
+
+def _solve_acyclic(mtx: MatrixType, b: numpy.ndarray, levels: List[numpy.ndarray]) -> numpy.ndarray:
+    """!
+    Solve (I-M)*x = b for an acyclic automaton by the back substitution
+    x = b + M*x processed level by level.
+
+    @param mtx: Transition matrix M
+    @param b: Right-hand side
+    @param levels: Topological levels of states (see topological_levels)
+
+    @return Solution
+    """
+    csr = scipy.sparse.csr_matrix(mtx, dtype=numpy.float64)
+    x = b.copy()
+    for level in levels[1:]:
+        x[level] += csr[level].dot(x)
+    return x
+
+
+def _solve_scc(mtx: MatrixType, b: numpy.ndarray, levels: List[List[numpy.ndarray]]) -> Tuple[numpy.ndarray, int, float]:
+    """!
+    Solve (I-M)*x = b by a block back substitution over strongly connected
+    components. States are renumbered level by level; components of a level
+    are mutually independent and all their successors are already solved,
+    hence the whole level is solved at once: by a division if it consists of
+    single states (possibly with a self-loop), by a (block diagonal) dense or
+    sparse LU otherwise.
+
+    @param mtx: Transition matrix M
+    @param b: Right-hand side
+    @param levels: Levels of components (see scc_levels)
+
+    @return Triple (solution, number of nonzeros of the LU factors of the
+        components, factorization time)
+    """
+    order = numpy.concatenate([numpy.concatenate(level) for level in levels])
+    bounds = numpy.cumsum([0] + [sum(len(comp) for comp in level) for level in levels]).tolist()
+    csr = scipy.sparse.csr_matrix(mtx, dtype=numpy.float64)[order][:, order].tocsr()
+    row_of = numpy.repeat(numpy.arange(csr.shape[0]), numpy.diff(csr.indptr))
+    perm_b = b[order]
+    y = numpy.zeros(b.shape)
+    fill_in, factor_time = 0, 0.0
+
+    for level, start, end in zip(levels, bounds, bounds[1:]):
+        lo, hi = csr.indptr[start], csr.indptr[end]
+        cols, vals, rows = csr.indices[lo:hi], csr.data[lo:hi], row_of[lo:hi] - start
+        inner = cols >= start
+        outer = ~inner
+        rhs = perm_b[start:end] + numpy.bincount(rows[outer], vals[outer] * y[cols[outer]], minlength=end-start)
+        if end - start == len(level):
+            denom = 1.0 - numpy.bincount(rows[inner], vals[inner], minlength=end-start)
+            if (denom == 0.0).any():
+                raise numpy.linalg.LinAlgError("Singular matrix")
+            y[start:end] = rhs / denom
+            continue
+        if end - start <= DENSE_STATES:
+            block = numpy.identity(end-start)
+            numpy.subtract.at(block, (rows[inner], cols[inner] - start), vals[inner])
+            tm = time.perf_counter()
+            y[start:end] = numpy.linalg.solve(block, rhs)
+            factor_time += time.perf_counter() - tm
+            fill_in += (end - start)**2
+        else:
+            block = scipy.sparse.csr_matrix((vals[inner], (rows[inner], cols[inner] - start)), shape=(end-start, end-start))
+            y[start:end], nnz, tm = _solve_sparse(block, rhs)
+            fill_in += nnz
+            factor_time += tm
+
+    x = numpy.empty(b.shape)
+    x[order] = y
+    return x, fill_in, factor_time
+
+
+def _solve_neumann(mtx: MatrixType, b: numpy.ndarray, tol: float, max_iter: int) -> Tuple[numpy.ndarray, int]:
+    """!
+    Solve (I-M)*x = b by summing the Neumann series b + M*b + M^2*b + ...
+    until the added term is negligible (relatively to tol).
+
+    @param mtx: Transition matrix M
+    @param b: Right-hand side
+    @param tol: Relative tolerance
+    @param max_iter: Maximum number of added terms
+
+    @return Pair (solution, number of iterations)
+    """
+    x = b.copy()
+    term = b.copy()
+    for i in range(max_iter):
+        term = numpy.asarray(mtx.dot(term)).ravel()
+        x += term
+        if numpy.abs(term).max() <= tol * numpy.abs(x).max():
+            return x, i+1
+    return x, max_iter
+
+
+def _solve_krylov(mtx: MatrixType, b: numpy.ndarray, backend: SolverBackend, tol: float, max_iter: int) -> Tuple[numpy.ndarray, int]:
+    """!
+    Solve (I-M)*x = b using a Krylov method (GMRES or BiCGSTAB).
+
+    @param mtx: Transition matrix M
+    @param b: Right-hand side
+    @param backend: SolverBackend.gmres or SolverBackend.bicgstab
+    @param tol: Relative tolerance
+    @param max_iter: Maximum number of iterations
+
+    @return Pair (solution, number of iterations)
+    """
+    counter = [0]
+    def count(_):
+        counter[0] += 1
+
+    op = scipy.sparse.identity(mtx.shape[0], dtype=numpy.float64, format="csr") - scipy.sparse.csr_matrix(mtx)
+    if backend == SolverBackend.gmres:
+        x, _ = scipy.sparse.linalg.gmres(op, b, rtol=tol, atol=0.0, maxiter=max_iter, callback=count, callback_type="pr_norm")
+    else:
+        x, _ = scipy.sparse.linalg.bicgstab(op, b, rtol=tol, atol=0.0, maxiter=max_iter, callback=count)
+    return x, max(counter[0], 1)
+
+
+def solve(mtx: MatrixType, b: numpy.ndarray, backend: SolverBackend=SolverBackend.auto, tol: float=TOLERANCE, max_iter: int=MAX_ITERATIONS) -> SolverResult:
+    """!
+    Solve (I-M)*x = b. Solutions of iterative backends are checked to have a
+    relative residual at most tol*100 (in the automatic mode, the sparse direct
+    solver is used if the iterative solver fails).
+
+    @param mtx: Transition matrix M (dense or sparse)
+    @param b: Right-hand side (1-D array)
+    @param backend: Backend (SolverBackend)
+    @param tol: Relative tolerance of iterative solvers
+    @param max_iter: Maximum number of iterations of iterative solvers
+
+    @return Solution with solver statistics (SolverResult)
+
+    @throw numpy.linalg.LinAlgError if I-M is singular or an iterative
+        solver does not converge
+    """
+    b = numpy.asarray(b, dtype=numpy.float64).ravel()
+    auto = backend == SolverBackend.auto
+    levels = None
+    if auto:
+        backend, levels = _auto_backend(mtx)
+    elif backend == SolverBackend.acyclic:
+        levels = topological_levels(mtx)
+        if levels is None:
+            raise numpy.linalg.LinAlgError("Automaton is not acyclic")
+    elif backend == SolverBackend.scc:
+        levels = scc_levels(mtx)
+
+    iterations, fill_in, factor_time = 0, 0, 0.0
+    if backend == SolverBackend.acyclic:
+        x = _solve_acyclic(mtx, b, levels)
+    elif backend == SolverBackend.scc:
+        x, fill_in, factor_time = _solve_scc(mtx, b, levels)
+    elif backend == SolverBackend.dense_lu:
+        start = time.perf_counter()
+        x = _solve_dense(mtx, b)
+        fill_in, factor_time = mtx.shape[0]**2, time.perf_counter() - start
+    elif backend == SolverBackend.sparse_direct:
+        x, fill_in, factor_time = _solve_sparse(mtx, b)
+    elif backend == SolverBackend.neumann:
+        x, iterations = _solve_neumann(mtx, b, tol, max_iter)
+    else:
+        x, iterations = _solve_krylov(mtx, b, backend, tol, max_iter)
+
+    res = residual(mtx, x, b)
+    if iterations > 0 and not res <= tol*100:
+        if auto:
+            x, fill_in, factor_time = _solve_sparse(mtx, b)
+            return SolverResult(x, SolverBackend.sparse_direct, 0, residual(mtx, x, b), fill_in, factor_time)
+        raise numpy.linalg.LinAlgError("Solver {0} did not converge (residual {1})".format(backend.name, res))
+    return SolverResult(x, backend, iterations, res, fill_in, factor_time)
@@ -29,11 +29,13 @@ import numpy
 import scipy.sparse
 import scipy.sparse.linalg
 import wfa.core_wfa as core_wfa
+import wfa.array_wfa as array_wfa
+import wfa.linear_solvers as linear_solvers
 import warnings
 from scipy.sparse import SparseEfficiencyWarning
 
 from enum import Enum
-from typing import List, Optional, Set, TypeVar, Generic, Callable
+from typing import List, Optional, Set, TypeVar, Generic, Callable, Tuple, Sequence
 
 StateType = int
 SymbolType = TypeVar("SymbolType")
@@ -59,6 +61,19 @@ class ClosureMode(Enum):
     iterations = 2
     ## Hotteling-Bodeqig algorithm
     hotelling_bodewig = 3
+    ## Solve a linear system instead of computing the closure (only for
+    ## language weights; the solver backend is selected automatically)
+    solve = 4
+
+class InnerProduct(Enum):
+    """!
+    Methods for computing inner products <A,B> = sum_w A(w)*B(w) of WFAs.
+    """
+
+    ## Language weight of the product automaton A x B
+    product = 1
+    ## Solution of the Stein equation over per-symbol matrices of A and B
+    stein = 2
 
 class MatrixWFAOperationException(Exception):
     """!
@@ -111,78 +126,101 @@ class MatrixWFA(core_wfa.CoreWFA):
         @return Compatibility of states
         """
         states = super(MatrixWFA, self).get_states()
+        return set(range(len(states))).issuperset(states)
 
-        for i in range(0, len(states)):
-            found = False
-            for state in states:
-                if state == i:
-                    found = True
-                    break
-            if not found:
-                return False
-
-        return True
 
-
-    def get_transition_matrix(self, sparse: bool=False) -> numpy.matrix:
+    def _get_operators(self, sparse: bool=False) -> Tuple[numpy.matrix, numpy.matrix, numpy.matrix]:
         """!
-        Get a transition matrix corresponding to the WFA.
+        Get the initial vector, the transition matrix and the final vector of
+        the WFA. The operators are assembled from the transitions at once and
+        cached until the WFA is modified (the returned matrices must not be
+        modified).
 
         @param sparse: Use sparse matrices
 
-        @return Transition matrix (Numpy.matrix)
+        @return Triple (initial vector, transition matrix, final vector)
         """
+        ops = self._operators.get(sparse)
+        if ops is not None:
+            return ops
         if not self.are_states_compatible():
             raise MatrixWFAOperationException("States must be renamed to the set {0,...,n}")
 
-        if sparse:
-            return self._get_transition_matrix_sparse()
-
         num_states = len(super(MatrixWFA, self).get_states())
-        mtx = numpy.matrix(numpy.empty((num_states,num_states,)))
-        mtx[:] = 0.0
+        transitions = super(MatrixWFA, self).get_transitions()
+        cnt = len(transitions)
+        src = numpy.fromiter((tr.src for tr in transitions), dtype=numpy.int64, count=cnt)
+        dest = numpy.fromiter((tr.dest for tr in transitions), dtype=numpy.int64, count=cnt)
+        weight = numpy.fromiter((tr.weight for tr in transitions), dtype=numpy.float64, count=cnt)
+        start = MatrixWFA._dense_vector(super(MatrixWFA, self).get_starts(), num_states)
+        final = MatrixWFA._dense_vector(super(MatrixWFA, self).get_finals(), num_states)
 
-        for transition in super(MatrixWFA, self).get_transitions():
-            mtx[transition.src, transition.dest] \
-                = mtx[transition.src, transition.dest] + transition.weight
+        ops = MatrixWFA._assemble(num_states, src, dest, weight, start, final, sparse)
+        self._operators[sparse] = ops
+        return ops
 
-        return mtx
 
+    @staticmethod
+    def _dense_vector(weights: StateFloatMapType, num_states: int) -> numpy.ndarray:
+        """!
+        Convert a mapping of states to weights to a dense vector.
 
-    def _get_transition_matrix_sparse(self) -> numpy.matrix:
+        @param weights: Dictionary: State -> float (weight)
+        @param num_states: Dimension of the vector
+
+        @return Dense vector (numpy.ndarray)
+        """
+        vec = numpy.zeros((num_states,), dtype=numpy.float64)
+        if len(weights) > 0:
+            vec[numpy.fromiter(weights.keys(), dtype=numpy.int64, count=len(weights))] = \
+                numpy.fromiter(weights.values(), dtype=numpy.float64, count=len(weights))
+        return vec
+
+
+    @staticmethod
+    def _assemble(num_states: int, src: numpy.ndarray, dest: numpy.ndarray, weight: numpy.ndarray, start: numpy.ndarray, final: numpy.ndarray, sparse: bool=False) -> Tuple[numpy.matrix, numpy.matrix, numpy.matrix]:
         """!
-        Get CSR representation of the transition matrix.
+        Assemble the initial vector, the transition matrix and the final
+        vector from arrays of transitions (weights of parallel transitions are
+        summed).
+
+        @param num_states: Number of states
+        @param src: Source states of transitions
+        @param dest: Destination states of transitions
+        @param weight: Weights of transitions
+        @param start: Dense vector of initial weights
+        @param final: Dense vector of final weights
+        @param sparse: Use sparse matrices
 
-        @return Sparse matrix representation (scipy.sparse.csr_matrix)
+        @return Triple (initial vector, transition matrix, final vector)
         """
-        if not self.are_states_compatible():
-            raise MatrixWFAOperationException("States must be renamed to the set {0,...,n}")
+        if sparse:
+            mtx = scipy.sparse.csr_matrix((weight, (src, dest)), shape=(num_states, num_states), dtype=numpy.float64)
+            return scipy.sparse.csr_matrix(numpy.matrix(start)), mtx, scipy.sparse.csr_matrix(numpy.matrix(final))
 
-        num_states = len(super(MatrixWFA, self).get_states())
-        tr_dict = super(MatrixWFA, self).get_dictionary_transitions()
+        mtx = numpy.zeros((num_states, num_states))
+        numpy.add.at(mtx, (src, dest), weight)
+        return numpy.matrix(start), numpy.matrix(mtx), numpy.matrix(final)
 
-        nonzeros = []
-        columns = []
-        row_num = [0]
 
-        for state in range(num_states):
-            row: dict[StateType, float] = {}
-            for transition in tr_dict[state]:
-                try:
-                    row[transition.dest] += transition.weight
-                except KeyError:
-                    row[transition.dest] = transition.weight
-            nonzero_elems = len(row)
-            for key in range(num_states):
-                val = row.get(key, None)
-                if val is not None:
-                    nonzeros.append(val)
-                    columns.append(key)
-            row_num.append(row_num[state] + nonzero_elems)
+    def get_transition_matrix(self, sparse: bool=False) -> numpy.matrix:
+        """!
+        Get a transition matrix corresponding to the WFA.
+
+        @param sparse: Use sparse matrices
 
+        @return Transition matrix (Numpy.matrix)
+        """
+        return self._get_operators(sparse)[1]
 
-        mtx = scipy.sparse.csr_matrix((nonzeros, columns, row_num), shape=(num_states, num_states), dtype=numpy.float64)
-        return mtx
+
+    def _get_transition_matrix_sparse(self) -> numpy.matrix:
+        """!
+        Get CSR representation of the transition matrix.
+
+        @return Sparse matrix representation (scipy.sparse.csr_matrix)
+        """
+        return self._get_operators(True)[1]
 
 
     def get_final_vector(self, sparse: bool=False) -> numpy.matrix:
@@ -193,19 +231,7 @@ class MatrixWFA(core_wfa.CoreWFA):
 
         @return Final vector (Numpy.matrix)
         """
-        if not self.are_states_compatible():
-            raise MatrixWFAOperationException("States must be renamed to the set {0,...,n}")
-
-        num_states = len(super(MatrixWFA, self).get_states())
-        mtx = numpy.matrix(numpy.empty((num_states,)))
-        mtx[:] = 0.0
-
-        for state, weight in super(MatrixWFA, self).get_finals().items():
-            mtx[0, state] = weight
-        if sparse:
-            return scipy.sparse.csr_matrix(mtx)
-        else:
-            return mtx
+        return self._get_operators(sparse)[2]
 
 
     def get_final_ones(self, sparse: bool=False) -> numpy.matrix:
@@ -217,19 +243,8 @@ class MatrixWFA(core_wfa.CoreWFA):
 
         @return Numpy.matrix (final states are set to one).
         """
-        if not self.are_states_compatible():
-            raise MatrixWFAOperationException("States must be renamed to the set {0,...,n}")
-
-        num_states = len(super(MatrixWFA, self).get_states())
-        mtx = numpy.matrix(numpy.empty((num_states,)))
-        mtx[:] = 0.0
-
-        for state, weight in super(MatrixWFA, self).get_finals().items():
-            if weight > 0.0:
-                mtx[0, state] = 1.0
-            else:
-                mtx[0, state] = 0.0
-
+        fin = self._get_operators(False)[2]
+        mtx = numpy.matrix((numpy.asarray(fin) > 0.0).astype(numpy.float64))
         if sparse:
             return scipy.sparse.csr_matrix(mtx)
         else:
@@ -244,19 +259,7 @@ class MatrixWFA(core_wfa.CoreWFA):
 
         @return Vector of initial weights (Numpy.matrix).
         """
-        if not self.are_states_compatible():
-            raise MatrixWFAOperationException("States must be renamed to the set {0,...,n}")
-
-        num_states = len(super(MatrixWFA, self).get_states())
-        mtx = numpy.matrix(numpy.empty((num_states,)))
-        mtx[:] = 0.0
-        for state, weight in super(MatrixWFA, self).get_starts().items():
-            mtx[0, state] = weight
-
-        if sparse:
-            return scipy.sparse.csr_matrix(mtx)
-        else:
-            return mtx
+        return self._get_operators(sparse)[0]
 
 
     @staticmethod
@@ -311,30 +314,37 @@ class MatrixWFA(core_wfa.CoreWFA):
         if len(super(MatrixWFA, self).get_states()) == 0:
             return None
 
-        num_states = len(super(MatrixWFA, self).get_states())
         transition_matrix = self.get_transition_matrix(sparse)
+        return MatrixWFA._compute_closure(transition_matrix, closure_mode, sparse, iterations, debug)
+
+
+    @staticmethod
+    def _compute_closure(transition_matrix: numpy.matrix, closure_mode: ClosureMode, sparse: bool=False, iterations: int=0, debug: bool=False) -> numpy.matrix:
+        """!
+        Compute transition closure of a given transition matrix by a specified
+        method.
+
+        @param transition_matrix: Transition matrix
+        @param closure_mode: Method for computing the transition closure (ClosureMode).
+        @param sparse: Use sparse matrices
+        @param iterations: Maximum number of iteration (in the case of iterative methods).
+        @param debug: Show debug info.
+
+        @return Transition closure (Numpy.matrix)
+        """
+        num_states = transition_matrix.shape[0]
         result = None
 
         if sparse:
             identity = scipy.sparse.identity(num_states, dtype=numpy.float64)
         else:
             identity = numpy.matrix(numpy.identity(len(transition_matrix)))
-        #identity = numpy.matrix(numpy.identity(len(transition_matrix)))
-        #identity = scipy.sparse.identity(num_states, dtype=numpy.float64)
-        #result = numpy.matrix(numpy.empty(len(transition_matrix)))
-
-
-        #debug = True
-        iterations = 100
-        closure_mode = ClosureMode.inverse
 
         if debug:
-            eig, _ = numpy.linalg.eig(transition_matrix)
+            eig = numpy.linalg.eigvals(transition_matrix.toarray() if sparse else transition_matrix)
             print("Eigenvalue: ", max(abs(eig)))
 
-        debug = True
-
-        if closure_mode == ClosureMode.inverse:
+        if closure_mode in (ClosureMode.inverse, ClosureMode.solve):
             if sparse:
                 result = MatrixWFA._get_sparse_inverse(identity - transition_matrix, num_states)
             else:
@@ -343,15 +353,10 @@ class MatrixWFA(core_wfa.CoreWFA):
             all_mult = identity
             result = identity
             for i in range(iterations):
-                if debug:
-                    print("Iteration: {0}".format(i))
                 all_mult = all_mult * transition_matrix
-                if i == 0:
-                    result = all_mult
-                else:
-                    result = result + all_mult
-
-                print(len(result.nonzero()[0]))
+                result = result + all_mult
+                if debug:
+                    print("Iteration: {0}, nonzeros: {1}".format(i, len(result.nonzero()[0])))
         elif closure_mode == ClosureMode.hotelling_bodewig:
             vn = identity
             mtx = identity - transition_matrix
@@ -363,8 +368,7 @@ class MatrixWFA(core_wfa.CoreWFA):
 
         return result
 
-    #TODO: Merge the following two methods
-    def compute_language_probability(self, closure_mode: ClosureMode, sparse: bool=False, iterations: int=0, debug: bool=False) -> float:
+    def compute_language_probability(self, closure_mode: ClosureMode, sparse: bool=False, iterations: int=0, debug: bool=False, backend: linear_solvers.SolverBackend=linear_solvers.SolverBackend.auto) -> float:
         """!
         Compute the total probability of the WFA's language.
 
@@ -372,12 +376,208 @@ class MatrixWFA(core_wfa.CoreWFA):
         @param sparse: Use sparse matrices
         @param iterations: Maximum number of iteration (in the case of iterative methods).
         @param debug: Show debug info.
+        @param backend: Solver backend (for ClosureMode.solve only)
 
         @return Weight of the language (float)
         """
         if len(super(MatrixWFA, self).get_states()) == 0:
             return 0.0
         ini = self.get_initial_vector(sparse)
-        fin = self.get_final_vector(sparse).transpose()
-        closure = self.compute_transition_closure(closure_mode, sparse, iterations, debug)
-        return ((ini*closure)*fin)[0,0]
+        fin = self.get_final_vector(sparse)
+        mtx = self.get_transition_matrix(sparse)
+        return MatrixWFA._compute_weight(ini, mtx, fin, closure_mode, sparse, iterations, debug, backend)
+
+
+    def solve_language_probability(self, backend: linear_solvers.SolverBackend=linear_solvers.SolverBackend.auto, tol: float=linear_solvers.TOLERANCE, max_iter: int=linear_solvers.MAX_ITERATIONS) -> Tuple[float, linear_solvers.SolverResult]:
+        """!
+        Compute the total probability of the WFA's language by solving
+        (I-M)*y = fin and report the solver statistics.
+
+        @param backend: Solver backend
+        @param tol: Relative tolerance of iterative solvers
+        @param max_iter: Maximum number of iterations of iterative solvers
+
+        @return Pair (weight of the language, solver result)
+        """
+        ini, mtx, fin = self._get_operators(True)
+        res = linear_solvers.solve(mtx, fin.toarray().ravel(), backend, tol, max_iter)
+        return float(ini.dot(res.x)[0]), res
+
+
+    @staticmethod
+    def _compute_weight(ini: numpy.matrix, transition_matrix: numpy.matrix, fin: numpy.matrix, closure_mode: ClosureMode, sparse: bool=False, iterations: int=0, debug: bool=False, backend: linear_solvers.SolverBackend=linear_solvers.SolverBackend.auto) -> float:
+        """!
+        Compute the language weight ini*(I-M)^{-1}*fin^T given by the initial
+        vector, the transition matrix M and the final vector. In the case of
+        ClosureMode.inverse and ClosureMode.solve, a single linear system
+        (I-M)*y = fin^T is solved instead of computing the whole inverse
+        (ClosureMode.inverse uses the dense or sparse LU according to sparse,
+        ClosureMode.solve the given backend). Systems of acyclic automata are
+        solved by a back substitution in a topological order (in the case of
+        ClosureMode.inverse or the automatic backend selection).
+
+        @param ini: Initial vector
+        @param transition_matrix: Transition matrix
+        @param fin: Final vector
+        @param closure_mode: Method for computing the transition closure (ClosureMode).
+        @param sparse: Use sparse matrices
+        @param iterations: Maximum number of iteration (in the case of iterative methods).
+        @param debug: Show debug info.
+        @param backend: Solver backend (for ClosureMode.solve only)
+
+        @return Weight of the language (float)
+        """
+        if closure_mode not in (ClosureMode.inverse, ClosureMode.solve):
+            closure = MatrixWFA._compute_closure(transition_matrix, closure_mode, sparse, iterations, debug)
+            return ((ini*closure)*fin.transpose())[0,0]
+
+        if closure_mode == ClosureMode.inverse:
+            if linear_solvers.topological_levels(transition_matrix) is not None:
+                backend = linear_solvers.SolverBackend.acyclic
+            else:
+                backend = linear_solvers.SolverBackend.sparse_direct if sparse else linear_solvers.SolverBackend.dense_lu
+        max_iter = iterations if iterations > 0 else linear_solvers.MAX_ITERATIONS
+        b = fin.toarray().ravel() if sparse else numpy.asarray(fin).ravel()
+        res = linear_solvers.solve(transition_matrix, b, backend, max_iter=max_iter)
+        if debug:
+            print("Solver: {0}, iterations: {1}, residual: {2}".format(res.backend.name, res.iterations, res.residual))
+        if sparse:
+            return float(ini.dot(res.x)[0])
+        return float(numpy.asarray(ini).ravel().dot(res.x))
+
+
+    @staticmethod
+    def get_array_operators(aut: array_wfa.ArrayWFA, sparse: bool=False) -> Tuple[numpy.matrix, numpy.matrix, numpy.matrix]:
+        """!
+        Assemble the initial vector, the transition matrix and the final
+        vector directly from an array-backed WFA.
+
+        @param aut: Array-backed WFA
+        @param sparse: Use sparse matrices
+
+        @return Triple (initial vector, transition matrix, final vector)
+        """
+        return MatrixWFA._assemble(aut.num_states(), aut.src, aut.dest, aut.weight, aut.start, aut.final, sparse)
+
+
+    @staticmethod
+    def compute_array_language_probability(aut: array_wfa.ArrayWFA, closure_mode: ClosureMode, sparse: bool=False, iterations: int=0, debug: bool=False, backend: linear_solvers.SolverBackend=linear_solvers.SolverBackend.auto) -> float:
+        """!
+        Compute the total probability of the language of an array-backed WFA.
+
+        @param aut: Array-backed WFA
+        @param closure_mode: Method for computing the transition closure (ClosureMode).
+        @param sparse: Use sparse matrices
+        @param iterations: Maximum number of iteration (in the case of iterative methods).
+        @param debug: Show debug info.
+        @param backend: Solver backend (for ClosureMode.solve only)
+
+        @return Weight of the language (float)
+        """
+        if aut.num_states() == 0:
+            return 0.0
+        ini, mtx, fin = MatrixWFA.get_array_operators(aut, sparse)
+        return MatrixWFA._compute_weight(ini, mtx, fin, closure_mode, sparse, iterations, debug, backend)
+
+
+    @staticmethod
+    def compute_array_inner_products(pairs: Sequence[Tuple[array_wfa.ArrayWFA, array_wfa.ArrayWFA]], backend: linear_solvers.SolverBackend=linear_solvers.SolverBackend.auto) -> numpy.ndarray:
+        """!
+        Compute inner products <A,B> (language weights of products A x B) of
+        a batch of pairs of array-backed WFAs. The systems of all products are
+        stacked into a single block-diagonal system, which is solved at once.
+
+        @param pairs: List of pairs of array-backed WFAs
+        @param backend: Solver backend
+
+        @return Array of inner products (in the order of pairs)
+        """
+        if len(pairs) == 0:
+            return numpy.zeros((0,))
+        left, loff = array_wfa.ArrayWFA.disjoint_union([a for a, _ in pairs])
+        right, roff = array_wfa.ArrayWFA.disjoint_union([b for _, b in pairs])
+
+        #Explore only pairs of states of the same product
+        seed1, seed2, block = [], [], []
+        for k, (a, b) in enumerate(pairs):
+            ini1, ini2 = numpy.nonzero(a.start)[0], numpy.nonzero(b.start)[0]
+            seed1.append(numpy.repeat(ini1, len(ini2)) + loff[k])
+            seed2.append(numpy.tile(ini2, len(ini1)) + roff[k])
+            block.append(numpy.full((len(ini1)*len(ini2),), k, dtype=numpy.int64))
+        seed1, seed2, block = numpy.concatenate(seed1), numpy.concatenate(seed2), numpy.concatenate(block)
+
+        prod = left.product(right, seeds=(seed1, seed2))
+        keep = prod.get_useful_states()
+        seed_keep = keep[:len(block)]
+        if not seed_keep.any():
+            return numpy.zeros((len(pairs),))
+        prod = prod.get_automata_restriction(keep)
+
+        num_states = prod.num_states()
+        mtx = scipy.sparse.csr_matrix((prod.weight, (prod.src, prod.dest)), shape=(num_states, num_states), dtype=numpy.float64)
+        res = linear_solvers.solve(mtx, prod.final, backend)
+        seeds = numpy.cumsum(keep)[:len(block)][seed_keep] - 1
+        return numpy.bincount(block[seed_keep], weights=prod.start[seeds]*res.x[seeds], minlength=len(pairs))
+
+
+    @staticmethod
+    def get_symbol_matrices(aut: array_wfa.ArrayWFA) -> dict:
+        """!
+        Get per-symbol transition matrices of an array-backed WFA.
+
+        @param aut: Array-backed WFA
+
+        @return Dictionary: Symbol -> transition matrix (scipy.sparse.csr_matrix)
+        """
+        num_states = aut.num_states()
+        ret = dict()
+        for code in numpy.unique(aut.sym).tolist():
+            sel = aut.sym == code
+            ret[aut.symbols[code]] = scipy.sparse.csr_matrix((aut.weight[sel], (aut.src[sel], aut.dest[sel])), shape=(num_states, num_states), dtype=numpy.float64)
+        return ret
+
+
+    @staticmethod
+    def compute_stein_inner_product(aut1: array_wfa.ArrayWFA, aut2: array_wfa.ArrayWFA, tol: float=linear_solvers.TOLERANCE, max_iter: int=linear_solvers.MAX_ITERATIONS) -> float:
+        """!
+        Compute the inner product <A,B> = sum_w A(w)*B(w) without building the
+        product automaton. The matrix Y = sum_w M_A(w) fin_A fin_B^T M_B(w)^T
+        is the solution of the Stein equation
+        Y = fin_A fin_B^T + sum_a M_a Y M'_a^T (M_a, M'_a are per-symbol
+        transition matrices of A and B), which is solved by GMRES using only
+        the per-symbol matrices. Then <A,B> = ini_A^T Y ini_B.
+
+        @param aut1: First array-backed WFA
+        @param aut2: Second array-backed WFA
+        @param tol: Relative tolerance
+        @param max_iter: Maximum number of iterations
+
+        @return Inner product <A,B>
+
+        @throw numpy.linalg.LinAlgError if the solver does not converge
+        """
+        n1, n2 = aut1.num_states(), aut2.num_states()
+        if n1 == 0 or n2 == 0:
+            return 0.0
+        mats1 = MatrixWFA.get_symbol_matrices(aut1)
+        mats2 = MatrixWFA.get_symbol_matrices(aut2)
+        shared = [(mats1[a], mats2[a]) for a in mats1.keys() if a in mats2]
+
+        def apply(vec: numpy.ndarray) -> numpy.ndarray:
+            y = vec.reshape((n1, n2))
+            res = y.copy()
+            for m1, m2 in shared:
+                res -= m1.dot(m2.dot(y.T).T)
+            return res.ravel()
+
+        rhs = numpy.outer(aut1.final, aut2.final).ravel()
+        if not rhs.any():
+            return 0.0
+        op = scipy.sparse.linalg.LinearOperator((n1*n2, n1*n2), matvec=apply, dtype=numpy.float64)
+        y, _ = scipy.sparse.linalg.gmres(op, rhs, rtol=tol, atol=0.0, maxiter=max_iter)
+
+        err = numpy.abs(apply(y) - rhs).max() / numpy.abs(rhs).max()
+        if not err <= tol*100:
+            raise numpy.linalg.LinAlgError("Stein solver did not converge (residual {0})".format(err))
+        return float(aut1.start.dot(y.reshape((n1, n2)).dot(aut2.start)))
+